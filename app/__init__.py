@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from flask import Flask, make_response, jsonify
+from flask import Flask, make_response, jsonify, current_app
 from .api import api
+from .lookup import lookup
 from .config import DefaultConfig
-from .exts import db, mail, migrate
+from .exts import db, mail, migrate, index, credentials, changes,\
+                  responses, metrics, snapshots, pools
 
 def create_app(config=None):
     """Creates the Flask app."""
@@ -19,6 +21,20 @@ def create_app(config=None):
     return app
 
 
+def create_lookup_app(config=None):
+    """Creates a read-only app answering address lookups from the
+    snapshot at SNAPSHOT_PATH, without a database."""
+    app = Flask(__name__)
+
+    configure_app(app, config)
+    snapshots.init_app(app)
+    configure_error_handlers(app)
+
+    app.register_blueprint(lookup)
+
+    return app
+
+
 def configure_app(app, config=None):
     """Different ways of configurations."""
 
@@ -42,6 +58,24 @@ def configure_extensions(app):
     # flask-migrate
     migrate.init_app(app, db)
 
+    # address pools from the database or config
+    pools.init_app(app)
+
+    # in-memory network index
+    index.init_app(app)
+
+    # cache for Basic auth logins
+    credentials.init_app(app)
+
+    # long polling on the change log
+    changes.init_app(app)
+
+    # serialized GET responses
+    responses.init_app(app)
+
+    # request timings for /metrics
+    metrics.init_app(app)
+
 
 def configure_error_handlers(app):
     @app.errorhandler(400)
@@ -53,6 +87,10 @@ def configure_error_handlers(app):
         return make_response(jsonify( { 'message': 'Unauthorized access' } ), 401,
           {'WWW-Authenticate': 'Basic realm="Login Required"'})
 
+    @app.errorhandler(403)
+    def forbidden(e):
+        return make_response(jsonify( { 'message': 'Forbidden' } ), 403)
+
     @app.errorhandler(404)
     def not_found(e):
         return make_response(jsonify( { 'message': 'Not found' } ), 404)
@@ -63,6 +101,7 @@ def configure_error_handlers(app):
 
     @app.errorhandler(500)
     def internal_error(e):
-        db.session.rollback()
+        if 'sqlalchemy' in current_app.extensions:
+            db.session.rollback()
         return make_response(jsonify( { 'message': 'internal server error' } ), 500)
 
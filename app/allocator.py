@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+from heapq import heappush, heappop
+
+
+class BuddyPool(object):
+    """Buddy allocator for the CIDR aligned blocks of one pool.
+
+    Free blocks are kept per prefix length in a set (membership) and a
+    heap (lowest address first). Entries removed from a set stay in the
+    heap until they reach the top.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.first = int(network.network_address)
+        self.last = self.first + network.num_addresses - 1
+        self.prefixlen = network.prefixlen
+        self.max_prefixlen = network.max_prefixlen
+        self.clear()
+
+    def clear(self):
+        levels = range(self.prefixlen, self.max_prefixlen + 1)
+        self.free = dict((p, set()) for p in levels)
+        self.heaps = dict((p, []) for p in levels)
+        self.reserved = set()
+        self._push(self.first, self.prefixlen)
+
+    def size(self, prefixlen):
+        return 1 << (self.max_prefixlen - prefixlen)
+
+    def _push(self, first, prefixlen):
+        self.free[prefixlen].add(first)
+        heappush(self.heaps[prefixlen], first)
+
+    def _lowest(self, prefixlen):
+        heap, free = self.heaps[prefixlen], self.free[prefixlen]
+        while heap and heap[0] not in free:
+            heappop(heap)
+        return heap[0] if heap else None
+
+    def _clamp(self, first, prefixlen):
+        if prefixlen < self.prefixlen:
+            return self.first, self.prefixlen
+        return first, prefixlen
+
+    def allocate(self, prefixlen):
+        """Returns the first address of the best fitting free block."""
+        if not self.prefixlen <= prefixlen <= self.max_prefixlen:
+            return None
+        for p in range(prefixlen, self.prefixlen - 1, -1):
+            block = self._lowest(p)
+            if block is not None:
+                return block
+        return None
+
+    def reserve(self, first, prefixlen):
+        first, prefixlen = self._clamp(first, prefixlen)
+        for p in range(prefixlen, self.prefixlen - 1, -1):
+            block = first & ~(self.size(p) - 1)
+            if block in self.free[p]:
+                self.free[p].discard(block)
+                while p < prefixlen:
+                    p += 1
+                    half = self.size(p)
+                    if first < block + half:
+                        self._push(block + half, p)
+                    else:
+                        self._push(block, p)
+                        block += half
+                self.reserved.add((first, prefixlen))
+                return True
+        return False
+
+    def release(self, first, prefixlen):
+        first, prefixlen = self._clamp(first, prefixlen)
+        if (first, prefixlen) not in self.reserved:
+            return False
+        self.reserved.discard((first, prefixlen))
+        while prefixlen > self.prefixlen:
+            buddy = first ^ self.size(prefixlen)
+            if buddy not in self.free[prefixlen]:
+                break
+            self.free[prefixlen].discard(buddy)
+            first = min(first, buddy)
+            prefixlen -= 1
+        self._push(first, prefixlen)
+        return True
+
+    def stats(self):
+        """Usage of the pool, read off the free lists.
+
+        allocatable is the number of aligned blocks of a prefix length
+        that could still be allocated. fragmentation is 0 while all free
+        addresses form one block and approaches 1 as they are scattered.
+        """
+        prefixes = []
+        allocatable = 0
+        largest = None
+        for p in range(self.prefixlen, self.max_prefixlen + 1):
+            free_blocks = len(self.free[p])
+            allocatable = 2 * allocatable + free_blocks
+            if free_blocks and largest is None:
+                largest = p
+            prefixes.append({ 'prefixlen' : p, 'free_blocks' : free_blocks,
+                              'allocatable' : allocatable })
+
+        size = self.size(self.prefixlen)
+        fragmentation = 0.0
+        if allocatable:
+            fragmentation = 1 - float(self.size(largest)) / allocatable
+        return {
+            'network' : self.network.exploded,
+            'num_addresses' : size,
+            'used' : size - allocatable,
+            'free' : allocatable,
+            'largest_free_prefixlen' : largest,
+            'fragmentation' : round(fragmentation, 4),
+            'prefixes' : prefixes,
+        }
+
+
+class Allocator(object):
+    """Buddy allocators for all pools, fed with index allocations."""
+
+    def __init__(self, networks):
+        self.pools = [BuddyPool(n) for n in networks]
+
+    def clear(self):
+        for pool in self.pools:
+            pool.clear()
+
+    def _pools_of(self, alloc):
+        return [p for p in self.pools
+                    if p.first <= alloc.last and alloc.first <= p.last]
+
+    def _block(self, pool, alloc):
+        num_addresses = alloc.last - alloc.first + 1
+        return alloc.first, pool.max_prefixlen - num_addresses.bit_length() + 1
+
+    def add(self, alloc):
+        for pool in self._pools_of(alloc):
+            pool.reserve(*self._block(pool, alloc))
+
+    def remove(self, alloc):
+        for pool in self._pools_of(alloc):
+            pool.release(*self._block(pool, alloc))
+
+    def allocate(self, prefixlen, networks = None):
+        """Allocates from the first pool with a free block, only from the
+        pools of networks if given."""
+        for pool in self.pools:
+            if networks is not None and pool.network not in networks:
+                continue
+            first = pool.allocate(prefixlen)
+            if first is not None:
+                return first
+        return None
+
+
+def compaction_plan(networks, allocs, prefixlen, count = 1):
+    """Suggests moves that free count aligned blocks of prefixlen.
+
+    Candidates are the partly used blocks with the fewest allocated
+    addresses. Their allocations move, largest first, to the lowest free
+    blocks of the same pool outside of them. Returns a list of ((first, last) of the freed
+    block, [(alloc, moved alloc)]).
+    """
+    allocator = Allocator(networks)
+    allocs = list(allocs)
+    for alloc in allocs:
+        allocator.add(alloc)
+
+    def blocks_of(alloc):
+        for i, pool in enumerate(allocator.pools):
+            if pool.prefixlen <= prefixlen and \
+                    pool.first <= alloc.last and alloc.first <= pool.last:
+                size = pool.size(prefixlen)
+                yield i, alloc.first & ~(size - 1), size
+
+    members = {}
+    too_large = set()
+    for alloc in allocs:
+        for key in blocks_of(alloc):
+            i, first, size = key
+            members.setdefault(key, []).append(alloc)
+            if alloc.last >= first + size:
+                too_large.add(key)
+
+    def used(key):
+        return sum(a.last - a.first + 1 for a in members[key])
+
+    # moving the networks of a full block would only use up another one
+    candidates = sorted((k for k in members
+                            if k not in too_large and used(k) < k[2]),
+                        key=lambda k: (used(k), len(members[k]), k))
+    plan = []
+    touched = set()
+    for key in candidates:
+        if len(plan) == count:
+            break
+        if key in touched:
+            continue
+        i, first, size = key
+        pool = allocator.pools[i]
+        for alloc in members[key]:
+            allocator.remove(alloc)
+        pool.reserve(first, prefixlen)
+
+        moves = []
+        for alloc in sorted(members[key], key=lambda a: a.first - a.last):
+            num_addresses = alloc.last - alloc.first + 1
+            # other pools may have other owners and prefix lengths
+            new_first = allocator.allocate(
+                pool.max_prefixlen - num_addresses.bit_length() + 1,
+                [pool.network])
+            if new_first is None:
+                break
+            moved = alloc._replace(first = new_first,
+                                   last = new_first + num_addresses - 1)
+            allocator.add(moved)
+            moves.append((alloc, moved))
+        else:
+            plan.append(((first, first + size - 1), moves))
+            for alloc, moved in moves:
+                touched.update(blocks_of(moved))
+            continue
+
+        for alloc, moved in moves:
+            allocator.remove(moved)
+        pool.release(first, prefixlen)
+        for alloc in members[key]:
+            allocator.add(alloc)
+    return plan
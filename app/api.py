@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, jsonify, abort, request, g, render_template
+from flask import Blueprint, jsonify, abort, request, g, render_template,\
+                  current_app, url_for, Response, stream_with_context
 from flask.views import MethodView
 from flask.ext.mail import Message
 from itsdangerous import BadTimeSignature
 from sqlalchemy.exc import IntegrityError
 from socket import error as socket_error
-from utils import gen_random_hash, requires_auth, get_max_prefixlen
-from models import User, Network, PasswordTooShortError
-from .exts import db, mail
+from utils import gen_random_hash, requires_auth, get_max_prefixlen,\
+                  stream_json_list, cached_response, retry_allocation,\
+                  reads_from_replica, requires_admin, flag_arg
+from models import User, Network, Change, PasswordTooShortError,\
+                   ConcurrentAllocation
+from .exts import db, changes, metrics, index, pools
+from .mailer import queue_mail
+from .transfer import FORMATS, MIMETYPES, encode, decode, export_records,\
+                      import_records
 
 api = Blueprint('api', __name__)
 
 class UserAPI(MethodView):
     @requires_auth
+    @reads_from_replica
+    @cached_response(per_user=True)
     def get(self):
         return jsonify(user=g.user.as_dict())
 
@@ -30,7 +39,7 @@ class UserAPI(MethodView):
                       sender="no-reply@ip.berlin.freifunk.net",
                       recipients=[user.email],
                       body = body)
-            mail.send(msg)
+            queue_mail(msg)
             db.session.add(user)
             db.session.commit()
             return jsonify(message='success')
@@ -60,11 +69,32 @@ class UserAPI(MethodView):
 
     @requires_auth
     def delete(self):
+        # the networks are deleted by the database
+        Change.log_allocations('delete',
+                               Network.locked_allocations_of([g.user.id]))
         db.session.delete(g.user)
         db.session.commit()
         return jsonify(message='success')
 
 
+@api.route('/user/token', methods=['POST'])
+@requires_auth
+def user_token():
+    # new tokens need the password, not another token
+    if request.authorization is None:
+        abort(401)
+    return jsonify(token=g.user.gen_api_token(),
+                   expires_in=current_app.config['API_TOKEN_TTL'])
+
+
+@api.route('/user/token', methods=['DELETE'])
+@requires_auth
+def user_token_revoke():
+    g.user.token = gen_random_hash(32)
+    db.session.commit()
+    return jsonify(message='success')
+
+
 @api.route('/users/<string:email>/lost_password')
 def user_lost_password(email):
     user = User.query.filter_by(email=email).first_or_404()
@@ -76,7 +106,8 @@ def user_lost_password(email):
               sender="no-reply@ip.berlin.freifunk.net",
               recipients=[user.email],
               body = body)
-    mail.send(msg)
+    queue_mail(msg)
+    db.session.commit()
     return jsonify(
         message='A confirmation mail has been sent to {}'.format(user.email))
 
@@ -99,7 +130,7 @@ def user_verify(email, token):
                           sender="no-reply@ip.berlin.freifunk.net",
                           recipients=[user.email],
                           body = body)
-                mail.send(msg)
+                queue_mail(msg)
 
             db.session.add(user)
             db.session.commit()
@@ -110,52 +141,113 @@ def user_verify(email, token):
     return jsonify( { 'message': 'error...' } ), 400
 
 
+def conflict_response(cidrs):
+    msg = 'ip address conflict: {}'.format(','.join(cidrs))
+    return jsonify( { 'error':  msg} ), 400
+
+
 class NetworkAPI(MethodView):
+    @reads_from_replica
+    @cached_response()
     def get(self, address, prefixlen):
-        if address is None or prefixlen is None:
-            no_networks = request.args.get('no_networks', type=bool, default=False)
-            networks = Network.get_all(no_networks = no_networks)
-            return jsonify(networks=map(lambda n: n.as_dict(), networks))
+        if address is None:
+            return self.list()
 
-        network = Network.get(address).first_or_404()
+        if prefixlen is None:
+            try:
+                network = Network.lookup(address)
+            except ValueError:
+                abort(400)
+            if network is None:
+                abort(404)
+        else:
+            network = Network.get(address, prefixlen).first_or_404()
         return jsonify(network=network.as_dict(compact=False))
 
+    def list(self):
+        no_networks = request.args.get('no_networks', type=bool, default=False)
+        stream = flag_arg('stream')
+        limit = request.args.get('limit', type=int)
+        after = request.args.get('after')
+
+        try:
+            networks = Network.get_all(no_networks = no_networks, after = after)
+        except ValueError:
+            abort(400)
+
+        if stream:
+            chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+            url_prefix = Network.url_prefix()
+            items = (n.as_dict(url_prefix=url_prefix)
+                        for n in networks.yield_per(chunk_size))
+            return Response(stream_with_context(
+                stream_json_list('networks', items)),
+                mimetype='application/json')
+
+        if limit is None and after is None:
+            return jsonify(networks=Network.as_dicts(networks))
+
+        max_limit = current_app.config['NETWORKS_PER_PAGE_MAX']
+        limit = max(1, min(limit or max_limit, max_limit))
+        page = networks.limit(limit).all()
+
+        next_url = None
+        if len(page) == limit:
+            args = dict(request.args.items(), limit=limit,
+                        after=page[-1].network_address)
+            next_url = url_for('.networks', _external=True, **args)
+
+        return jsonify(networks=Network.as_dicts(page), next=next_url)
+
+    @retry_allocation
     def post(self):
-        if 'address' in request.form:
+        picked = 'address' not in request.form
+        if not picked:
             address = request.form['address']
             prefixlen = request.form.get('prefixlen', type=int, default=
                             get_max_prefixlen(address))
-            try:
-                qry = Network.overlaps_with(address, prefixlen)
-            except ValueError as e:
-                return jsonify( { 'error': str(e) } ), 400
-
-            if qry.count() > 0:
-                conflicts = ','.join(map(lambda n: n.cidr, qry.all()))
-                msg = 'ip address conflict: {}'.format(conflicts)
-                return jsonify( { 'error':  msg} ), 400
-
         else:
             prefixlen = request.form.get('prefixlen', type=int, default=32)
-            address = Network.next_unused_network(prefixlen)
+            address = Network.next_unused_network(prefixlen, owner=g.user)
+            if address is None:
+                msg = 'no free network with prefixlen {}'.format(prefixlen)
+                return jsonify( { 'error' : msg }), 400
 
         try:
             network = Network(g.user, address, prefixlen)
-            db.session.add(network)
-            db.session.commit()
-        except AssertionError as e:
+            conflicts = network.conflicts()
+        except (AssertionError, ValueError) as e:
+            db.session.rollback()
             return jsonify( { 'error' : str(e) }), 400
 
+        if conflicts:
+            if picked:
+                raise ConcurrentAllocation()
+            db.session.rollback()
+            return conflict_response(conflicts)
+
+        db.session.add(network)
+        db.session.commit()
         return jsonify(message='success', network=network.as_dict())
 
+    @retry_allocation
     def put(self, address, prefixlen):
         network = Network.get(address, prefixlen).first_or_404()
 
-        if 'address' in request.form:
-            network.network_address = request.form['address']
+        try:
+            if 'address' in request.form:
+                network.network_address = request.form['address']
+
+            if 'prefixlen' in request.form:
+                network.prefixlen = int(request.form['prefixlen'])
+            conflicts = network.conflicts()
+        except (AssertionError, ValueError) as e:
+            db.session.rollback()
+            return jsonify( { 'error' : str(e) }), 400
 
-        if 'prefixlen' in request.form:
-            network.prefixlen = int(request.form['prefixlen'])
+        if conflicts:
+            db.session.rollback()
+            return conflict_response(conflicts)
 
         db.session.commit()
 
@@ -171,6 +263,205 @@ class NetworkAPI(MethodView):
         return jsonify(message='success')
 
 
+@api.route('/networks/lookup', methods=['POST'])
+@requires_auth
+@reads_from_replica
+def networks_lookup():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        addresses = data.get('addresses')
+    else:
+        addresses = request.form.getlist('address')
+
+    if not isinstance(addresses, list) or \
+            len(addresses) > current_app.config['LOOKUP_MAX_ADDRESSES']:
+        abort(400)
+
+    networks = []
+    for address, found in zip(addresses, Network.lookup_many(addresses)):
+        cidr, owner = found or (None, None)
+        networks.append({ 'address' : address, 'network' : cidr,
+                          'owner' : owner })
+
+    return jsonify(networks=networks)
+
+
+@api.route('/networks/bulk', methods=['POST'])
+@requires_auth
+@retry_allocation
+def networks_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('networks'), list)\
+            or len(data['networks']) > current_app.config['BULK_MAX_NETWORKS']:
+        abort(400)
+
+    items = []
+    for item in data['networks']:
+        if not isinstance(item, dict):
+            abort(400)
+        items.append((item.get('address'), item.get('prefixlen')))
+
+    results = Network.create_many(g.user, items)
+    errors = [dict(index=i, error=error)
+                for i, (network, error) in enumerate(results) if error]
+    if errors and not data.get('partial', False):
+        db.session.rollback()
+        return jsonify(message='no networks created', errors=errors), 400
+
+    networks = [network for network, error in results if network]
+    db.session.add_all(networks)
+    db.session.flush()
+    # the commit expires the networks, each would be loaded again
+    dicts = Network.as_dicts(networks)
+    db.session.commit()
+    return jsonify(message='success', networks=dicts, errors=errors)
+
+
+@api.route('/networks/<string:address>/<int:prefixlen>/hosts')
+@requires_auth
+@reads_from_replica
+def network_hosts(address, prefixlen):
+    network = Network.get(address, prefixlen).first_or_404()
+
+    if flag_arg('stream'):
+        return Response(stream_json_list('hosts', network.hosts()),
+                        mimetype='application/json')
+
+    max_limit = current_app.config['HOSTS_PER_PAGE_MAX']
+    offset = max(0, request.args.get('offset', type=int, default=0))
+    limit = request.args.get('limit', type=int, default=max_limit)
+    limit = max(1, min(limit, max_limit))
+    hosts = list(network.hosts(offset, limit))
+
+    next_url = None
+    first_host, last_host = network.host_range
+    if first_host + offset + limit <= last_host:
+        next_url = url_for('.network_hosts', address=address,
+            prefixlen=prefixlen, offset=offset + limit, limit=limit,
+            _external=True)
+
+    return jsonify(hosts=hosts, next=next_url)
+
+
+@api.route('/changes')
+@requires_auth
+@reads_from_replica
+def change_log():
+    config = current_app.config
+    since = request.args.get('since', type=int, default=0)
+    limit = request.args.get('limit', type=int,
+                             default=config['CHANGES_PER_PAGE_MAX'])
+    limit = max(1, min(limit, config['CHANGES_PER_PAGE_MAX']))
+    wait = request.args.get('wait', type=float, default=0)
+    wait = max(0, min(wait, config['CHANGES_MAX_WAIT']))
+
+    entries = changes.since(since, limit, wait)
+    last_seq = entries[-1].seq if entries else since
+    # user rows carry emails, only admins see those of other users
+    if g.user.email not in config['ADMINS']:
+        entries = [c for c in entries
+                   if c.table != 'user' or c.object_id == g.user.id]
+    return jsonify(changes=map(lambda c: c.as_dict(), entries),
+                   last_seq=last_seq)
+
+
+def users_by_email(emails):
+    """The users of a list of emails, 400 if any of them is unknown."""
+    if not isinstance(emails, list) or not emails:
+        abort(400)
+    users = User.query.filter(User.email.in_(emails)).all()
+    if len(users) != len(set(emails)):
+        abort(400)
+    return users
+
+
+def admin_request():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    return data
+
+
+@api.route('/admin/networks/delete', methods=['POST'])
+@requires_admin
+def admin_networks_delete():
+    owners = users_by_email(admin_request().get('owners'))
+    deleted = Network.delete_owned_by([u.id for u in owners])
+    db.session.commit()
+    return jsonify(message='success', deleted=deleted)
+
+
+@api.route('/admin/networks/reassign', methods=['POST'])
+@requires_admin
+def admin_networks_reassign():
+    data = admin_request()
+    owners = users_by_email(data.get('owners'))
+    new_owner, = users_by_email([data.get('to')])
+    try:
+        reassigned = Network.reassign_owned_by([u.id for u in owners],
+                                               new_owner)
+    except AssertionError as e:
+        db.session.rollback()
+        return jsonify( { 'error' : str(e) }), 400
+    db.session.commit()
+    return jsonify(message='success', reassigned=reassigned)
+
+
+@api.route('/admin/users/delete', methods=['POST'])
+@requires_admin
+def admin_users_delete():
+    users = users_by_email(admin_request().get('users'))
+    allocs = Network.locked_allocations_of([u.id for u in users])
+    # the networks are deleted by the database
+    Change.log_allocations('delete', allocs)
+    for user in users:
+        db.session.delete(user)
+    db.session.commit()
+    return jsonify(message='success', deleted=len(users),
+                   networks=len(allocs))
+
+
+def transfer_format():
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        abort(400)
+    return fmt
+
+
+@api.route('/admin/export')
+@requires_admin
+def admin_export():
+    fmt = transfer_format()
+    return Response(stream_with_context(encode(fmt, export_records())),
+                    mimetype=MIMETYPES[fmt])
+
+
+@api.route('/admin/import', methods=['POST'])
+@requires_admin
+def admin_import():
+    fmt = transfer_format()
+    stats = import_records(decode(fmt, request.stream))
+    return jsonify(message='success', **stats)
+
+
+@api.route('/pools')
+@requires_auth
+def pools_view():
+    index.sync()
+    rules = dict((p.network.exploded, p.as_dict())
+                    for p in pools.current.pools)
+    stats = index.pools()
+    for pool in stats:
+        pool.update(rules.get(pool['network'], {}))
+    return jsonify(pools=stats)
+
+
+@api.route('/metrics')
+def metrics_view():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 user_view = UserAPI.as_view('user')
 api.add_url_rule('/user', view_func=user_view,
     methods=['GET', 'POST', 'PUT', 'DELETE'])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import time
+
+from hashlib import sha256
+from flask import current_app, g
+from itsdangerous import BadSignature
+from .cache import LRUCache
+
+
+class CredentialState(object):
+    def __init__(self, maxsize, ttl):
+        # digest of email and password -> user id
+        self.credentials = LRUCache(maxsize, ttl)
+        # user id -> column values of the user
+        self.users = LRUCache(maxsize, ttl)
+        # when the change log was last checked for changed users
+        self.synced_at = 0
+
+
+class CredentialCache(object):
+    """Caches successful Basic auth logins per app.
+
+    Credentials are only kept as a keyed digest. Changing or deleting a
+    user drops its entry, and a cached digest only counts if the email and
+    password hash of the cached user still match, so a cached login can't
+    outlive a new password or email.
+
+    Users changed by other processes are dropped once the index syncs
+    with the change log, which happens at least every
+    AUTH_CACHE_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['credential_cache'] = CredentialState(
+            app.config['AUTH_CACHE_SIZE'], app.config['AUTH_CACHE_TTL'])
+
+    @property
+    def state(self):
+        return current_app.extensions['credential_cache']
+
+    def digest(self, email, password):
+        secret = current_app.config['SECRET'].encode('utf-8')
+        msg = u'{}\0{}'.format(email, password).encode('utf-8')
+        return hmac.new(secret, msg, sha256).hexdigest()
+
+    def sync(self):
+        """Drops the users changed by other processes, at most every
+        AUTH_CACHE_SYNC_INTERVAL seconds."""
+        from .exts import index
+        state = self.state
+        now = time.time()
+        if now - state.synced_at < \
+           current_app.config['AUTH_CACHE_SYNC_INTERVAL']:
+            return
+        # a cache filled before the index is loaded would miss changes
+        index.sync(load = True)
+        state.synced_at = now
+
+    def count(self, method, result):
+        from .exts import metrics
+        metrics.state.inc('auth_cache_total', method = method,
+                          result = result)
+
+    def matches(self, values, email, password):
+        from .utils import hash_password
+        return values['email'] == email and values['verified'] and \
+               values['password_hash'] == hash_password(
+                   current_app.config['SALT'], password)
+
+    def authenticate(self, email, password):
+        """Like User.auth, but without a query for cached credentials."""
+        from .models import User
+        self.sync()
+        state = self.state
+        key = self.digest(email, password)
+
+        user_id = state.credentials.get(key)
+        values = state.users.get(user_id) if user_id is not None else None
+        # the digest may have been cached before the user was changed and
+        # reloaded, the user itself has to match the credentials
+        if values is not None and self.matches(values, email, password):
+            self.count('basic', 'hit')
+            g.user = User.from_snapshot(values)
+            return True
+
+        self.count('basic', 'miss')
+        if not User.auth(email, password):
+            return False
+
+        state.credentials.put(key, g.user.id)
+        state.users.put(g.user.id, g.user.snapshot())
+        return True
+
+    def authenticate_token(self, signed_token):
+        """Checks a signed api token, usually without any query.
+
+        The token embeds the user's rotating token, which is compared to
+        the cached user. Only unknown users are loaded from the database,
+        a token revoked by another process stops working once the cache
+        syncs.
+        """
+        from .models import User
+        try:
+            user_id, token = User.load_api_token(signed_token)
+        except (BadSignature, TypeError, ValueError):
+            return False
+
+        self.sync()
+        state = self.state
+        values = state.users.get(user_id)
+        if values is None:
+            self.count('token', 'miss')
+            user = User.query.get(user_id)
+            if user is None:
+                return False
+            values = user.snapshot()
+            state.users.put(user_id, values)
+        else:
+            self.count('token', 'hit')
+
+        if values['token'] != token or not values['verified']:
+            return False
+
+        g.user = User.from_snapshot(values)
+        return True
+
+    def invalidate(self, user_id):
+        self.state.users.pop(user_id)
+
+    def clear(self):
+        self.state.users.clear()
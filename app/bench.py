@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from contextlib import contextmanager
+from ipaddress import ip_address
+from multiprocessing import Process, Queue
+from flask import json
+from sqlalchemy import event
+from . import create_app
+from .config import SQLiteProductionConfig
+from .exts import db, pools
+from .models import User
+
+BENCH_EMAIL = u'bench@example.org'
+BENCH_PASSWORD = u'bench123'
+
+
+def percentile(values, p):
+    """Returns the p-th percentile (0-100) of values, None if empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def auth_headers(email = BENCH_EMAIL, password = BENCH_PASSWORD):
+    credentials = base64.b64encode(u'{}:{}'.format(email, password)
+                                   .encode('utf-8'))
+    return [('Authorization', 'Basic ' + credentials.decode('ascii'))]
+
+
+@contextmanager
+def bench_app(**config):
+    """An app with a verified user on a throwaway database file."""
+    tmpdir = tempfile.mkdtemp()
+    settings = dict(
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+        DEBUG = False,
+        MAIL_QUEUE = False,
+    )
+    settings.update(config)
+    app = create_app(type('BenchConfig', (object,), settings))
+    try:
+        with app.app_context():
+            db.create_all()
+            user = User(BENCH_EMAIL, BENCH_PASSWORD)
+            user.verified = True
+            db.session.add(user)
+            db.session.commit()
+            db.session.remove()
+        yield app
+    finally:
+        with app.app_context():
+            db.get_engine(app).dispose()
+        shutil.rmtree(tmpdir)
+
+
+def mixed_workload(app, processes = 4, duration = 5, write_ratio = 0.1,
+                   seed_networks = 200):
+    """Lookups and allocations from several worker processes at once.
+
+    Reads are GET /networks/<address> of random seeded networks, writes
+    allocate a /30 each. Returns the throughput and latencies per kind.
+    """
+    headers = auth_headers()
+    client = app.test_client()
+    items = [{ 'prefixlen' : 28 } for i in range(seed_networks)]
+    response = client.post('/networks/bulk', headers = headers,
+        content_type = 'application/json',
+        data = json.dumps({ 'networks' : items }))
+    addresses = [n['network'].split('/')[0]
+                    for n in json.loads(response.data)['networks']]
+    # forked workers must not share pooled connections
+    with app.app_context():
+        db.get_engine(app).dispose()
+
+    deadline = time.time() + duration
+    queue = Queue()
+
+    def run():
+        random.seed()
+        client = app.test_client()
+        # latencies of successful requests and status codes of failed ones
+        stats = { 'read' : ([], []), 'write' : ([], []) }
+        while time.time() < deadline:
+            kind = 'write' if random.random() < write_ratio else 'read'
+            started = time.time()
+            if kind == 'write':
+                response = client.post('/networks', headers = headers,
+                                       data = { 'prefixlen' : 30 })
+            else:
+                response = client.get('/networks/' + random.choice(addresses),
+                                      headers = headers)
+            latencies, errors = stats[kind]
+            if response.status_code == 200:
+                latencies.append(time.time() - started)
+            else:
+                errors.append(response.status_code)
+        queue.put(stats)
+
+    workers = [Process(target = run) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    stats = [queue.get() for worker in workers]
+    for worker in workers:
+        worker.join()
+
+    result = dict(processes = processes, duration = duration,
+                  write_ratio = write_ratio)
+    for kind in ('read', 'write'):
+        latencies = sum((s[kind][0] for s in stats), [])
+        errors = sum((s[kind][1] for s in stats), [])
+        result[kind] = {
+            'ops_per_sec' : round(len(latencies) / float(duration), 1),
+            'errors' : len(errors),
+            'p50_ms' : round(percentile(latencies, 50) * 1000, 2)
+                            if latencies else None,
+            'p99_ms' : round(percentile(latencies, 99) * 1000, 2)
+                            if latencies else None,
+        }
+    return result
+
+
+def sqlite_profiles(**kwargs):
+    """Runs mixed_workload with the default and the production SQLite
+    settings."""
+    production = dict((k, v) for k, v in vars(SQLiteProductionConfig).items()
+                        if k.isupper())
+    results = {}
+    for name, config in [('default', {}), ('production', production)]:
+        with bench_app(**config) as app:
+            results[name] = mixed_workload(app, **kwargs)
+    return results
+
+
+def seed_networks(networks):
+    """Yields addresses of /28 networks round robin over the pool
+    networks.
+
+    They are 32 addresses apart, the other half of each block stays
+    free like in a fragmented address space.
+    """
+    ranges = [(int(n.network_address), int(n.broadcast_address))
+                for n in networks]
+    offset = 0
+    while ranges:
+        for first, last in list(ranges):
+            if first + offset > last:
+                ranges.remove((first, last))
+                continue
+            yield first + offset
+        offset += 32
+
+
+def seed(client, headers, addresses, count, chunk_size = 1000):
+    """Allocates count networks from addresses through /networks/bulk,
+    returns their addresses."""
+    seeded = []
+    while len(seeded) < count:
+        chunk = [next(addresses)
+                    for i in range(min(count - len(seeded), chunk_size))]
+        items = [{ 'address' : str(ip_address(a)), 'prefixlen' : 28 }
+                    for a in chunk]
+        response = client.post('/networks/bulk', headers = headers,
+            content_type = 'application/json',
+            data = json.dumps({ 'networks' : items }))
+        assert response.status_code == 200, response.data
+        seeded.extend(chunk)
+    return seeded
+
+
+def measure(app, client, requests):
+    """Sends requests, an iterable of (method, url, kwargs), one by one.
+
+    Returns latency percentiles, queries per request, throughput and the
+    status codes of the responses.
+    """
+    queries = []
+    def count_query(*args):
+        queries[-1] += 1
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count_query)
+    latencies = []
+    statuses = {}
+    started = time.time()
+    try:
+        for method, url, kwargs in requests:
+            queries.append(0)
+            t = time.time()
+            response = client.open(url, method = method, **kwargs)
+            latencies.append(time.time() - t)
+            statuses[response.status_code] = \
+                statuses.get(response.status_code, 0) + 1
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    elapsed = time.time() - started
+
+    ms = lambda p: round(percentile(latencies, p) * 1000, 3)
+    return {
+        'requests' : len(latencies),
+        'p50_ms' : ms(50),
+        'p90_ms' : ms(90),
+        'p99_ms' : ms(99),
+        'max_ms' : round(max(latencies) * 1000, 3),
+        'queries_per_request' : round(sum(queries) / float(len(queries)), 2),
+        'requests_per_sec' : round(len(latencies) / elapsed, 1),
+        'statuses' : dict((str(k), v) for k, v in statuses.items()),
+    }
+
+
+def endpoints(allocated, taken, headers, token_headers, empty_headers,
+              first_pool):
+    """Request factories per benchmarked endpoint.
+
+    allocated are the seeded network addresses, lookups and pages pick
+    random ones. Explicit allocations take the free upper halves of
+    seeded blocks and add them to taken. They stay out of the first
+    pool, which next_unused_network fills from the bottom.
+    """
+    address = lambda packed: str(ip_address(packed))
+    free = (a + 16 for a in reversed(allocated)
+                if a + 16 not in taken and
+                   not first_pool.network_address <= ip_address(a)
+                       <= first_pool.broadcast_address)
+    def take():
+        packed = next(free)
+        taken.add(packed)
+        return address(packed)
+
+    return [
+        ('allocate_next_unused', lambda: ('POST', '/networks',
+            { 'headers' : headers, 'data' : { 'prefixlen' : 28 } })),
+        ('allocate_address', lambda: ('POST', '/networks',
+            { 'headers' : headers, 'data' : {
+                'address' : take(), 'prefixlen' : 28 } })),
+        ('lookup_address', lambda: ('GET', '/networks/{}'.format(
+            address(random.choice(allocated) + random.randrange(16))),
+            { 'headers' : headers })),
+        ('list_page', lambda: ('GET', '/networks?limit=100&after={}'.format(
+            address(random.choice(allocated))), { 'headers' : headers })),
+        ('auth_basic', lambda: ('GET', '/user',
+            { 'headers' : empty_headers })),
+        ('auth_token', lambda: ('GET', '/user',
+            { 'headers' : token_headers })),
+    ]
+
+
+def run_suite(sizes = (1000, 10000, 100000), requests = 200,
+              production = False):
+    """Benchmarks the endpoints at growing numbers of allocations.
+
+    The networks are seeded through the test client, each size adds to
+    the previous one. Returns a dict meant to be dumped as JSON.
+    """
+    config = {}
+    if production:
+        config = dict((k, v) for k, v in vars(SQLiteProductionConfig).items()
+                        if k.isupper())
+
+    results = {
+        'meta' : {
+            'python' : platform.python_version(),
+            'sqlite' : sqlite3.sqlite_version,
+            'production' : production,
+            'requests' : requests,
+            'started_at' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'sizes' : {},
+    }
+
+    with bench_app(**config) as app:
+        client = app.test_client()
+        headers = auth_headers()
+        with app.app_context():
+            empty = User(u'empty@example.org', BENCH_PASSWORD)
+            empty.verified = True
+            db.session.add(empty)
+            db.session.commit()
+            networks = pools.current.networks
+            db.session.remove()
+        empty_headers = auth_headers(u'empty@example.org', BENCH_PASSWORD)
+        response = client.post('/user/token', headers = empty_headers)
+        token = json.loads(response.data)['token']
+        token_headers = [('Authorization', 'Bearer ' + token)]
+
+        addresses = seed_networks(networks)
+        allocated = []
+        taken = set()
+        for size in sorted(sizes):
+            started = time.time()
+            allocated.extend(seed(client, headers, addresses,
+                                  size - len(allocated)))
+            result = { 'seed_seconds' : round(time.time() - started, 2) }
+
+            for name, factory in endpoints(allocated, taken, headers,
+                                           token_headers, empty_headers,
+                                           networks[0]):
+                result[name] = measure(app, client,
+                    (factory() for i in range(requests)))
+            results['sizes'][str(size)] = result
+    return results
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app
+
+_missing = object()
+
+
+class LRUCache(object):
+    """Thread safe LRU cache with an optional time to live per entry.
+
+    maxsize bounds the number of entries, or their total weight if a
+    weigh function is given.
+    """
+
+    def __init__(self, maxsize, ttl = None, weigh = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh or (lambda value: 1)
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default = None):
+        with self._lock:
+            value, expires = self._data.pop(key, (_missing, None))
+            if value is not _missing and expires and expires < time.time():
+                self.weight -= self.weigh(value)
+                value = _missing
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        weight = self.weigh(value)
+        if weight > self.maxsize:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (value, expires)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                self.weight -= self.weigh(self._data.popitem(last=False)[1][0])
+
+    def _pop(self, key):
+        value = self._data.pop(key, (None, None))[0]
+        if value is not None:
+            self.weight -= self.weigh(value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+
+class ResponseCache(object):
+    """Serialized responses of an app, bounded by RESPONSE_CACHE_BYTES."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_cache'] = LRUCache(
+            app.config['RESPONSE_CACHE_BYTES'],
+            weigh=lambda value: len(value[0]))
+
+    @property
+    def cache(self):
+        return current_app.extensions['response_cache']
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def put(self, key, data, mimetype):
+        self.cache.put(key, (data, mimetype))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from threading import Condition
+from flask import current_app
+
+
+class ChangeFeed(object):
+    """Long polling on the change log.
+
+    Commits of this process wake up waiting requests right away, changes
+    of other processes are picked up every CHANGES_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['change_feed'] = Condition()
+
+    def notify(self):
+        condition = current_app.extensions['change_feed']
+        with condition:
+            condition.notify_all()
+
+    def since(self, seq, limit, wait = 0):
+        """Returns up to limit changes after seq, waiting up to wait
+        seconds for the first one."""
+        from .exts import db
+        from .models import Change
+        condition = current_app.extensions['change_feed']
+        interval = current_app.config['CHANGES_POLL_INTERVAL']
+        deadline = time.time() + wait
+
+        while True:
+            changes = Change.query.filter(Change.seq > seq)\
+                                  .order_by(Change.seq).limit(limit).all()
+            remaining = deadline - time.time()
+            if changes or remaining <= 0:
+                return changes
+
+            # end the read transaction to see commits of other processes
+            db.session.rollback()
+            with condition:
+                condition.wait(min(interval, remaining))
@@ -7,5 +7,66 @@ class DefaultConfig(object):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(os.path.dirname(__file__), '..', 'app.db')
     SALT = '<enter your salt here>'
+    # emails of the users allowed to use the /admin endpoints
+    ADMINS = []
     SECRET = '<enter your secret here>'
     MAIL_PORT = 1025
+    MAIL_QUEUE = True
+    MAIL_BATCH_SIZE = 50
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_DELAY = 60
+    MAIL_WORKER_INTERVAL = 5
+    AUTH_CACHE_SIZE = 1024
+    AUTH_CACHE_TTL = 300
+    # seconds users changed by other processes may stay cached
+    AUTH_CACHE_SYNC_INTERVAL = 1
+    API_TOKEN_TTL = 3600
+    LOOKUP_MAX_ADDRESSES = 10000
+    BULK_MAX_NETWORKS = 1000
+    CHANGES_PER_PAGE_MAX = 1000
+    CHANGES_MAX_WAIT = 30
+    CHANGES_POLL_INTERVAL = 1
+    RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+    NETWORKS_PER_PAGE_MAX = 1000
+    STREAM_CHUNK_SIZE = 500
+    HOSTS_PER_PAGE_MAX = 1000
+    ALLOCATION_LOCK = True
+    ALLOCATION_RETRIES = 3
+    INDEX_SYNC_MAX_CHANGES = 1000
+    # seconds a missing change log seq is waited for, see IndexState.sync
+    INDEX_SYNC_GAP_TIMEOUT = 60
+    SQLITE_PRAGMAS = {}
+    SQLITE_BUSY_TIMEOUT = 5
+    SLOW_REQUEST_SECONDS = None
+    # used while the pool table is empty, keys as in pools.AddressPool
+    POOLS = [
+        { 'network' : '10.0.0.0/8' },
+        { 'network' : '172.16.0.0/12' },
+        { 'network' : '192.168.0.0/16' },
+    ]
+    POOLS_CACHE_TTL = 60
+    SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), '..', 'networks.snapshot')
+    # the lookup app has no authentication, owner emails are left out
+    LOOKUP_SHOW_OWNER = False
+
+
+class SQLiteProductionConfig(object):
+    """SQLite settings for several workers on one database file.
+
+    WAL lets readers go on while a writer commits, writers wait for each
+    other instead of failing with "database is locked". Copy these to
+    production.cfg to use them.
+    """
+
+    SQLITE_PRAGMAS = {
+        'journal_mode' : 'WAL',
+        # durable across application crashes, not power loss in WAL mode
+        'synchronous' : 'NORMAL',
+        # in KiB when negative
+        'cache_size' : -64000,
+        'mmap_size' : 256 * 1024 * 1024,
+    }
+    SQLITE_BUSY_TIMEOUT = 30
+    SQLALCHEMY_POOL_SIZE = 8
+    SQLALCHEMY_MAX_OVERFLOW = 8
+    SQLALCHEMY_POOL_TIMEOUT = 30
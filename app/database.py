@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+# key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+def sqlite_pragmas(pragmas):
+    """Returns a pool connect listener setting pragmas on new connections."""
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in sorted(pragmas.items()):
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+    return on_connect
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads to the replica bind while info['replica'] is set.
+
+    The first statement that isn't a plain SELECT, e.g. a flush, clears
+    it. Everything after that goes to the primary, so the session reads
+    its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get('replica'):
+            binds = self.app.config['SQLALCHEMY_BINDS'] or {}
+            if REPLICA_BIND in binds and isinstance(clause, Select) and \
+                    clause._for_update_arg is None:
+                return get_state(self.app).db.get_engine(self.app,
+                                                        bind=REPLICA_BIND)
+            self.info['replica'] = False
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy, plus the SQLite settings of the app config.
+
+    SQLITE_PRAGMAS are set on every new connection, foreign keys are
+    enforced unless they turn it off. SQLITE_BUSY_TIMEOUT
+    is how many seconds a connection waits for a lock. Setting
+    SQLALCHEMY_POOL_SIZE keeps connections to a database file open in a
+    pool instead of opening one per session.
+
+    Sessions can read from a replica, see RoutingSession.
+    """
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        in_memory = info.database in (None, '', ':memory:')
+        super(Database, self).apply_driver_hacks(app, info, options)
+        if info.drivername != 'sqlite':
+            return
+
+        connect_args = options.setdefault('connect_args', {})
+        connect_args['timeout'] = app.config['SQLITE_BUSY_TIMEOUT']
+
+        if not in_memory and options.get('pool_size'):
+            options['poolclass'] = QueuePool
+            connect_args['check_same_thread'] = False
+
+        pragmas = dict(app.config['SQLITE_PRAGMAS'])
+        # needed for ON DELETE CASCADE
+        pragmas.setdefault('foreign_keys', 'ON')
+        options['pool_events'] = [(sqlite_pragmas(pragmas), 'connect')]
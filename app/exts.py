@@ -1,10 +1,31 @@
 # -*- coding: utf-8 -*-
 
-from flask.ext.sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+from .database import Database
+db = Database()
 
 from flask.ext.mail import Mail
 mail = Mail()
 
 from flask.ext.migrate import Migrate
 migrate = Migrate()
+
+from .index import NetworkIndex
+index = NetworkIndex()
+
+from .auth import CredentialCache
+credentials = CredentialCache()
+
+from .changes import ChangeFeed
+changes = ChangeFeed()
+
+from .cache import ResponseCache
+responses = ResponseCache()
+
+from .metrics import Metrics
+metrics = Metrics()
+
+from .pools import PoolRegistry
+pools = PoolRegistry()
+
+from .snapshot import SnapshotReader
+snapshots = SnapshotReader()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import count
+from threading import RLock
+from time import time
+from flask import current_app
+from .allocator import Allocator
+from .utils import gen_network_packed
+
+
+class Allocation(namedtuple('Allocation', ['id', 'first', 'last', 'owner_id'])):
+    __slots__ = ()
+
+    @property
+    def cidr(self):
+        return gen_network_packed(self.first, self.last - self.first + 1).exploded
+
+
+class IntervalIndex(object):
+    """Allocated ranges sorted by their first address.
+
+    Allocations never overlap each other (the API refuses conflicting
+    networks), so all ranges overlapping a query sit next to each other.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.starts = []
+        self.rows = {}
+
+    def add(self, alloc):
+        insort(self.starts, (alloc.first, alloc.id))
+        self.rows[alloc.id] = alloc
+
+    def remove(self, alloc):
+        del self.starts[bisect_left(self.starts, (alloc.first, alloc.id))]
+        del self.rows[alloc.id]
+
+    def overlapping(self, first, last):
+        i = bisect_left(self.starts, (last + 1,))
+        found = []
+        while i > 0:
+            i -= 1
+            alloc = self.rows[self.starts[i][1]]
+            if alloc.last < first:
+                break
+            found.append(alloc)
+        found.reverse()
+        return found
+
+
+class PrefixTable(object):
+    """Longest prefix match over allocations.
+
+    There is one dict per block size in use, mapping the network address
+    to its allocation. A lookup masks the address once per size, starting
+    with the smallest blocks, i.e. the longest prefixes.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.tables = {}
+        self.host_bits = []
+
+    def _host_bits(self, alloc):
+        return (alloc.last - alloc.first + 1).bit_length() - 1
+
+    def add(self, alloc):
+        bits = self._host_bits(alloc)
+        if bits not in self.tables:
+            self.tables[bits] = {}
+            self.host_bits = sorted(self.tables)
+        self.tables[bits][alloc.first] = alloc
+
+    def remove(self, alloc):
+        bits = self._host_bits(alloc)
+        table = self.tables[bits]
+        if table.get(alloc.first) == alloc:
+            del table[alloc.first]
+        if not table:
+            del self.tables[bits]
+            self.host_bits = sorted(self.tables)
+
+    def lookup(self, address):
+        for bits in self.host_bits:
+            alloc = self.tables[bits].get(address >> bits << bits)
+            if alloc is not None:
+                return alloc
+        return None
+
+
+class IndexState(object):
+    """Per-app index, loaded from the network table on first use."""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.loaded = False
+        self.intervals = IntervalIndex()
+        self.prefixes = PrefixTable()
+        self.allocator = None
+        # the PoolSet the allocator was built for
+        self.pools = None
+        self.version = 0
+        # last change log entry applied from the database
+        self.seq = 0
+        # missing seqs below seq -> when they were noticed
+        self.gaps = {}
+        self._snapshot = None
+
+    @property
+    def structures(self):
+        return (self.intervals, self.prefixes, self.allocator)
+
+    def load(self):
+        from .exts import db
+        from .exts import credentials, pools
+        from .models import Network, Change
+        with self.lock:
+            # changes before seq aren't read, the users may be among them
+            credentials.clear()
+            with db.session.no_autoflush:
+                self.seq = Change.last_seq()
+                start = max(0, self.seq -
+                               current_app.config['INDEX_SYNC_MAX_CHANGES'])
+                seqs = db.session.query(Change.seq)\
+                                 .filter(Change.seq > start)\
+                                 .order_by(Change.seq).all()
+            self.gaps = {}
+            self.track_gaps(start, [seq for seq, in seqs])
+            self.pools = pools.current
+            self.allocator = Allocator(self.pools.networks)
+            for structure in self.structures:
+                structure.clear()
+            for alloc in Network.allocations():
+                for structure in self.structures:
+                    structure.add(alloc)
+            self.version += 1
+            self.loaded = True
+
+    def apply(self, changes):
+        """Applies committed changes, a dict of id -> Allocation or None."""
+        with self.lock:
+            # all removals first, a range may have moved to another id
+            for id in changes:
+                old = self.intervals.rows.get(id)
+                if old is not None:
+                    for structure in self.structures:
+                        structure.remove(old)
+            for alloc in changes.values():
+                if alloc is not None:
+                    for structure in self.structures:
+                        structure.add(alloc)
+            self.version += 1
+
+    def track_gaps(self, start, seqs):
+        """Remembers the numbers after start missing from the sorted
+        seqs of committed changes."""
+        now = time()
+        seen = set(seqs)
+        for seq in range(start + 1, seqs[-1] if seqs else start):
+            if seq not in seen:
+                self.gaps.setdefault(seq, now)
+
+    def sync(self, limit, gap_timeout):
+        """Applies the network changes logged after seq, which includes
+        the commits of other processes, and drops the changed users from
+        the credential cache. Reloads if there are more than limit of them.
+
+        On PostgreSQL, a transaction may commit its change after one with
+        a higher seq. Missing seqs are checked again on every sync until
+        they show up or gap_timeout seconds have passed, the latter are
+        left by transactions that rolled back. Two changes of the same
+        network can't be reordered, the second one waits for the row
+        lock of the first transaction.
+        """
+        from .exts import db, credentials
+        from .models import Change
+        with self.lock:
+            expired = time() - gap_timeout
+            for seq, noticed in list(self.gaps.items()):
+                if noticed < expired:
+                    del self.gaps[seq]
+
+            with db.session.no_autoflush:
+                rows = Change.query.filter(Change.seq > self.seq)\
+                                   .order_by(Change.seq).limit(limit + 1).all()
+                late = []
+                if self.gaps:
+                    late = Change.query\
+                        .filter(Change.seq.in_(list(self.gaps)))\
+                        .order_by(Change.seq).all()
+            if len(rows) > limit or len(self.gaps) > limit:
+                self.load()
+                return
+
+            for change in late:
+                del self.gaps[change.seq]
+            if rows:
+                self.track_gaps(self.seq, [c.seq for c in rows])
+                self.seq = rows[-1].seq
+            changes = [c for c in late + rows if c.table == 'network']
+            if changes:
+                self.apply(Change.network_allocations(changes))
+            for change in late + rows:
+                if change.table == 'user':
+                    credentials.invalidate(change.object_id)
+
+    def snapshot(self):
+        """Returns parallel lists of first addresses, last addresses and
+        allocations, sorted by first address."""
+        with self.lock:
+            if self._snapshot is None or self._snapshot[0] != self.version:
+                allocs = [self.intervals.rows[id]
+                            for first, id in self.intervals.starts]
+                self._snapshot = (self.version, [a.first for a in allocs],
+                                  [a.last for a in allocs], allocs)
+            return self._snapshot[1:]
+
+
+class Plan(object):
+    """Tentative allocations on top of a locked index.
+
+    Reservations only live in the allocator until the plan is undone,
+    the committed networks are added to the index as usual.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.intervals = IntervalIndex()
+        self.ids = count(-1, -1)
+
+    def conflicts(self, first, last):
+        return self.state.intervals.overlapping(first, last) + \
+               self.intervals.overlapping(first, last)
+
+    def allocate(self, prefixlen, networks = None):
+        return self.state.allocator.allocate(prefixlen, networks)
+
+    def reserve(self, first, last, owner_id = None):
+        alloc = Allocation(next(self.ids), first, last, owner_id)
+        self.intervals.add(alloc)
+        self.state.allocator.add(alloc)
+        return alloc
+
+    def undo(self):
+        for alloc in self.intervals.rows.values():
+            self.state.allocator.remove(alloc)
+        self.intervals.clear()
+
+
+class NetworkIndex(object):
+    """Process-local index over all allocated networks.
+
+    It is kept up to date from the commits of this process and catches
+    up with other processes through the change log on sync(). Their
+    commits may still be missing in between, so anything the index
+    reports as free has to be confirmed by the database.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['network_index'] = IndexState()
+
+    @property
+    def state(self):
+        from .exts import pools
+        state = current_app.extensions['network_index']
+        if not state.loaded or state.pools is not pools.current:
+            state.load()
+        return state
+
+    def apply(self, changes):
+        state = current_app.extensions['network_index']
+        if state.loaded:
+            state.apply(changes)
+
+    def invalidate(self):
+        current_app.extensions['network_index'].loaded = False
+
+    def sync(self, load = False):
+        """Catches up with the change log. An index that isn't loaded
+        is up to date once it is, unless load loads it right away."""
+        state = self.state if load else \
+                current_app.extensions['network_index']
+        if state.loaded:
+            state.sync(current_app.config['INDEX_SYNC_MAX_CHANGES'],
+                       current_app.config['INDEX_SYNC_GAP_TIMEOUT'])
+
+    def overlapping(self, first, last):
+        state = self.state
+        with state.lock:
+            return state.intervals.overlapping(first, last)
+
+    def lookup(self, address):
+        state = self.state
+        with state.lock:
+            return state.prefixes.lookup(address)
+
+    def lookup_many(self, addresses):
+        """Resolves many addresses at once against a sorted snapshot.
+
+        Returns the containing allocation (or None) in input order.
+        """
+        firsts, lasts, allocs = self.state.snapshot()
+        found = []
+        for address in addresses:
+            i = bisect_right(firsts, address) - 1
+            if i >= 0 and address <= lasts[i]:
+                found.append(allocs[i])
+            else:
+                found.append(None)
+        return found
+
+    def pools(self):
+        """Usage statistics of every pool, see BuddyPool.stats."""
+        state = self.state
+        with state.lock:
+            return [pool.stats() for pool in state.allocator.pools]
+
+    @contextmanager
+    def planning(self):
+        """Locks the index for a Plan, which is undone afterwards."""
+        state = self.state
+        with state.lock:
+            plan = Plan(state)
+            try:
+                yield plan
+            finally:
+                plan.undo()
+
+    def allocate(self, prefixlen, networks = None):
+        state = self.state
+        with state.lock:
+            return state.allocator.allocate(prefixlen, networks)
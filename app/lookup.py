@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from flask import Blueprint, current_app, jsonify, abort
+from utils import pack_address, gen_network_packed
+from .exts import snapshots
+
+lookup = Blueprint('lookup', __name__)
+
+
+@lookup.route('/networks/<string:address>')
+def network_lookup(address):
+    snapshot = snapshots.snapshot
+    if snapshot is None:
+        return jsonify(message='no snapshot'), 503
+
+    try:
+        found = snapshot.lookup(pack_address(address))
+    except ValueError:
+        abort(400)
+    if found is None:
+        abort(404)
+
+    first, last, owner = found
+    network = gen_network_packed(first, last - first + 1)
+    data = {
+        'network'   : network.exploded,
+        'address'   : network.network_address.exploded,
+        'prefixlen' : network.prefixlen,
+    }
+    if current_app.config['LOOKUP_SHOW_OWNER']:
+        data['owner'] = owner
+    return jsonify(network=data)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from smtplib import SMTPException
+from socket import error as socket_error
+from threading import Thread, Event
+from flask import current_app
+from .exts import db, mail, metrics
+from .models import OutgoingMail
+
+
+def queue_mail(msg):
+    """Queues msg in the outbox, sent after the current transaction commits.
+
+    With MAIL_QUEUE disabled the message is sent right away.
+    """
+    if not current_app.config['MAIL_QUEUE']:
+        with metrics.timed('mail_send_duration_seconds'):
+            mail.send(msg)
+        return
+
+    db.session.add(OutgoingMail(msg))
+
+
+def send_queued(batch_size = None):
+    """Sends a batch of pending mails over a single SMTP connection.
+
+    Failed mails are retried with exponential backoff until
+    MAIL_MAX_ATTEMPTS is reached. Returns the number of sent mails.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    rows = OutgoingMail.pending(now)\
+                       .limit(batch_size or config['MAIL_BATCH_SIZE']).all()
+    if not rows:
+        return 0
+
+    def failed(row, error):
+        delay = config['MAIL_RETRY_DELAY'] * 2 ** row.attempts
+        row.attempts += 1
+        row.next_attempt_at = now + timedelta(seconds = delay)
+        row.last_error = str(error)[:256]
+
+    sent = 0
+    try:
+        with mail.connect() as conn:
+            for row in rows:
+                try:
+                    with metrics.timed('mail_send_duration_seconds'):
+                        conn.send(row.message)
+                    row.sent_at = datetime.utcnow()
+                    sent += 1
+                except SMTPException as e:
+                    failed(row, e)
+    except (socket_error, SMTPException) as e:
+        for row in rows:
+            if row.sent_at is None:
+                failed(row, e)
+
+    db.session.commit()
+    return sent
+
+
+class MailWorker(Thread):
+    """Sends queued mails of app in the background.
+
+    Only one worker should run per database, a mail might be sent twice
+    otherwise.
+    """
+
+    def __init__(self, app):
+        super(MailWorker, self).__init__(name = 'mail-worker')
+        self.daemon = True
+        self.app = app
+        self.stopped = Event()
+
+    def run(self):
+        interval = self.app.config['MAIL_WORKER_INTERVAL']
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    sent = send_queued()
+                except Exception:
+                    self.app.logger.exception('sending queued mails failed')
+                    db.session.rollback()
+                    sent = 0
+                finally:
+                    db.session.remove()
+
+            if not sent:
+                self.stopped.wait(interval)
+
+    def stop(self):
+        self.stopped.set()
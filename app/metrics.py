@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from flask import current_app, request, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# seconds, like the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+class Histogram(object):
+    def __init__(self, buckets = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        total = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield '{}_bucket{} {}'.format(name,
+                format_labels(labels + (('le', le),)), total)
+        yield '{}_sum{} {}'.format(name, format_labels(labels), self.sum)
+        yield '{}_count{} {}'.format(name, format_labels(labels), total)
+
+
+class MetricsState(object):
+    """Counters and histograms of an app, keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def inc(self, name, value = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def render(self):
+        """The Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters),
+                                  ('histogram', self.histograms)):
+                last = None
+                for name, labels in sorted(metrics):
+                    if name != last:
+                        if name in self.help:
+                            lines.append('# HELP {} {}'.format(name,
+                                                               self.help[name]))
+                        lines.append('# TYPE {} {}'.format(name, kind))
+                        last = name
+                    value = metrics[(name, labels)]
+                    if kind == 'counter':
+                        lines.append('{}{} {}'.format(name,
+                            format_labels(labels), value))
+                    else:
+                        lines.extend(value.lines(name, labels))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics(object):
+    """SQL statistics of the current request."""
+
+    def __init__(self, capture):
+        self.started = time.time()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        # (statement, seconds) of all queries, for the slow request log
+        self.statements = [] if capture else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = getattr(g, 'request_metrics', None) if has_app_context() \
+                else None
+    if not isinstance(stats, RequestMetrics):
+        return
+    elapsed = time.time() - started
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    if stats.statements is not None:
+        stats.statements.append((statement, elapsed))
+
+
+class Metrics(object):
+    """Per endpoint latency, SQL, auth and mail timings of an app.
+
+    Requests slower than SLOW_REQUEST_SECONDS are logged with their SQL.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = app.extensions['metrics'] = MetricsState()
+        state.help.update({
+            'http_request_duration_seconds' : 'Request latency per endpoint',
+            'http_requests_total' : 'Responses per endpoint and status',
+            'sql_queries_total' : 'SQL queries per endpoint',
+            'sql_duration_seconds_total' : 'SQL time per endpoint',
+            'auth_duration_seconds' : 'Time spent authenticating',
+            'auth_cache_total' : 'Credential cache hits and misses',
+            'mail_send_duration_seconds' : 'Time spent sending mails',
+        })
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+
+    @property
+    def state(self):
+        return current_app.extensions['metrics']
+
+    def start_request(self):
+        capture = current_app.config['SLOW_REQUEST_SECONDS'] is not None
+        g.request_metrics = RequestMetrics(capture)
+
+    def end_request(self, response):
+        stats = getattr(g, 'request_metrics', None)
+        if not isinstance(stats, RequestMetrics):
+            return response
+
+        elapsed = time.time() - stats.started
+        endpoint = request.endpoint or 'unknown'
+        state = self.state
+        state.observe('http_request_duration_seconds', elapsed,
+                      endpoint = endpoint, method = request.method)
+        state.inc('http_requests_total', endpoint = endpoint,
+                  method = request.method, status = response.status_code)
+        state.inc('sql_queries_total', stats.queries, endpoint = endpoint)
+        state.inc('sql_duration_seconds_total', stats.sql_seconds,
+                  endpoint = endpoint)
+
+        threshold = current_app.config['SLOW_REQUEST_SECONDS']
+        if threshold is not None and elapsed >= threshold:
+            current_app.logger.warning(
+                'slow request %s %s: %.1f ms, %d queries in %.1f ms\n%s',
+                request.method, request.path, elapsed * 1000, stats.queries,
+                stats.sql_seconds * 1000, '\n'.join(
+                    '  {:.1f} ms {}'.format(t * 1000, s)
+                    for s, t in stats.statements))
+        return response
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Observes the duration of the block in the histogram name."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.state.observe(name, time.time() - started, **labels)
+
+    def render(self):
+        return self.state.render()
@@ -1,30 +1,36 @@
 # -*- coding: utf-8 -*-
 
-from flask import g, url_for, current_app
+from datetime import datetime
+from flask import g, url_for, current_app, json
+from flask.ext.mail import Message
 from ipaddress import ip_address, ip_network
-from sqlalchemy.orm import validates, reconstructor
+from sqlalchemy import event, and_, or_
+from sqlalchemy.orm import validates, Session,\
+                           make_transient_to_detached
 from validate_email import validate_email
 from itsdangerous import URLSafeTimedSerializer
-from utils import get_prefix_len, hash_password, gen_network, gen_random_hash,\
-                  get_max_prefixlen, get_num_addresses
-from .exts import db
-
-VALID_NETWORKS = [
-    ip_network(u'10.0.0.0/8'),
-    ip_network(u'172.16.0.0/12'),
-    ip_network(u'192.168.0.0/16')
-]
+from utils import hash_password, gen_network, gen_random_hash,\
+                  get_max_prefixlen, gen_network_packed, pack_address
+from .exts import db, index, credentials, changes, pools
+from .index import Allocation, IntervalIndex
+from .pools import AddressPool
 
 class PasswordTooShortError(ValueError):
     pass
 
+class ConcurrentAllocation(Exception):
+    """A picked address was allocated by another request meanwhile."""
+    pass
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     email = db.Column(db.String(128), nullable = False, unique = True)
     password_hash = db.Column(db.String(128), nullable = False)
     token  = db.Column(db.String(128))
+    # the database deletes the networks of a deleted user, they aren't
+    # loaded for that
     networks = db.relationship('Network', backref='owner', lazy='dynamic',
-                               cascade='all')
+                               cascade='all', passive_deletes=True)
     verified = db.Column(db.Boolean, default = False)
 
     def __init__(self, email, password):
@@ -53,6 +59,19 @@ class User(db.Model):
         except:
             return False
 
+    def snapshot(self):
+        return dict((c.name, getattr(self, c.name))
+                        for c in User.__table__.columns)
+
+    @staticmethod
+    def from_snapshot(values):
+        """Adds a user to the session from snapshot() values, no query."""
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def verify_signed_token(self, signed_token, namespace, timeout = 3600):
         secret = current_app.config['SECRET']
         serializer = URLSafeTimedSerializer(secret, namespace)
@@ -63,6 +82,23 @@ class User(db.Model):
         serializer = URLSafeTimedSerializer(secret, namespace)
         return serializer.dumps(self.token)
 
+    def gen_api_token(self):
+        secret = current_app.config['SECRET']
+        serializer = URLSafeTimedSerializer(secret, 'api_token')
+        return serializer.dumps([self.id, self.token])
+
+    @staticmethod
+    def load_api_token(signed_token):
+        """Returns user id and token of a signed api token.
+
+        Raises BadSignature if the token is invalid or expired.
+        """
+        secret = current_app.config['SECRET']
+        serializer = URLSafeTimedSerializer(secret, 'api_token')
+        max_age = current_app.config['API_TOKEN_TTL']
+        user_id, token = serializer.loads(signed_token, max_age=max_age)
+        return user_id, token
+
     @property
     def verify_namespace(self):
         return 'lost_password' if self.verified else 'registration'
@@ -85,7 +121,9 @@ class User(db.Model):
         return {
           'id' : self.id,
           'email' : self.email,
-          'networks' : map(lambda n: n.as_dict(exclude_owner=True), self.networks)
+          'networks' : Network.as_dicts(
+              self.networks.order_by(Network.address_packed),
+              exclude_owner=True)
         }
 
     def __repr__(self):
@@ -95,63 +133,229 @@ class User(db.Model):
 class Network(db.Model):
     id = db.Column(db.Integer, primary_key = True)
     address_packed = db.Column(db.BigInteger, nullable = False)
+    address_last = db.Column(db.BigInteger, nullable = False)
     num_addresses = db.Column(db.Integer, nullable = False)
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable = False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id',
+                         ondelete = 'CASCADE'), nullable = False, index = True)
     pinged_at = db.Column(db.DateTime())
 
-    def __init__(self, owner, address, prefixlen = 32):
-        self.network = gen_network(address, prefixlen)
-        self.address_packed = int(self.network.network_address)
-        self.num_addresses = self.network.num_addresses
+    __table_args__ = (
+        db.Index('ix_network_address_range', 'address_packed', 'address_last'),
+        # networks don't overlap, so no two of them start at the same address
+        db.Index('ix_network_address_packed', 'address_packed', unique = True),
+    )
+
+    def __init__(self, owner, address, prefixlen = 32, planned = None):
+        net = gen_network(address, prefixlen)
+        self.num_addresses = net.num_addresses
+        self.address_packed = int(net.network_address)
+        self.address_last = self.address_packed + self.num_addresses - 1
+        self.check_owner(owner, planned)
         self.owner = owner
 
-    @reconstructor
-    def init_on_load(self):
-        addr = ip_address(self.address_packed)
-        prefixlen = get_prefix_len(addr.max_prefixlen, self.num_addresses)
-        self.network = gen_network(addr.exploded, prefixlen)
+    @property
+    def network(self):
+        """The ip_network, built from the integer columns on access."""
+        return gen_network_packed(self.address_packed, self.num_addresses)
+
+    @property
+    def pool(self):
+        return pools.current.find(self.address_packed, self.address_last)
 
     @validates('address_packed')
     def validate_address_packed(self, key, address_packed):
+        pool_set = pools.current
+        last = address_packed + self.num_addresses - 1
+        pool = pool_set.find(address_packed, last)
         msg =  'Only subnetworks of the following networks are allowed {}'.format(
-            ', '.join(map(lambda n: str(n), VALID_NETWORKS))
-        )
-        assert any(map(lambda n: self.network.overlaps(n), VALID_NETWORKS)), msg
+            pool_set)
+        assert pool is not None, msg
+        pool.check(prefixlen = gen_network_packed(address_packed,
+                                                  self.num_addresses).prefixlen)
+        if self.owner is not None:
+            self.check_owner(self.owner, pool = pool)
         return address_packed
 
+    def check_owner(self, owner, planned = None, pool = None):
+        """Raises AssertionError if owner may not hold the network in its
+        pool, or exceeds the quota there. planned maps pool networks to
+        addresses of owner not in the database yet."""
+        pool = pool or self.pool
+        pool.check(owner = owner)
+        if pool.quota is None:
+            return
+
+        used = Network.used_in(owner, pool, planned, self.id)
+        assert used + self.num_addresses <= pool.quota, \
+            'Quota of {} addresses in {} exceeded'.format(pool.quota,
+                                                         pool.network)
+
+    @staticmethod
+    def used_in(owner, pool, planned = None, exclude_id = None):
+        """Addresses owner holds in pool, including the planned ones."""
+        used = (planned or {}).get(pool.network, 0)
+        if owner.id is not None:
+            with db.session.no_autoflush:
+                qry = db.session.query(db.func.sum(Network.num_addresses))\
+                    .filter(Network.owner_id == owner.id,
+                            Network.address_packed >= pool.first,
+                            Network.address_packed <= pool.last)
+                if exclude_id is not None:
+                    qry = qry.filter(Network.id != exclude_id)
+                used += qry.scalar() or 0
+        return used
+
+    @staticmethod
+    def candidates(prefixlen, owner = None, planned = None):
+        """Pool networks owner may pick prefixlen from, without the pools
+        whose quota the new block would exceed."""
+        used = None
+        if owner is not None:
+            used = lambda pool: Network.used_in(owner, pool, planned)
+        return pools.current.candidates(prefixlen, owner, used)
+
+    @staticmethod
+    def overlaps_range(first, last):
+        """Filter clause for networks overlapping [first, last].
+
+        Networks don't overlap each other, so besides the ones starting
+        within the range only the closest one starting before it can
+        reach into it. Both are range scans on ix_network_address_range.
+        """
+        preceding = db.session.query(db.func.max(Network.address_packed))\
+                              .filter(Network.address_packed < first)\
+                              .as_scalar()
+        return or_(
+            and_(Network.address_packed >= first,
+                 Network.address_packed <= last),
+            and_(Network.address_packed == preceding,
+                 Network.address_last >= first))
+
     @staticmethod
     def overlaps_with(address, prefixlen = None):
         if prefixlen is None:
             prefixlen = get_max_prefixlen(address)
         net = gen_network(address, prefixlen)
-        addr = int(net.network_address)
+        first = int(net.network_address)
         return Network.query.filter(
-            Network.address_packed <= addr + net.num_addresses,
-            addr <= Network.address_packed + Network.num_addresses)
+            Network.overlaps_range(first, first + net.num_addresses - 1))
 
     @staticmethod
-    def next_unused_network(prefixlen, ip_version=4):
-        for net in VALID_NETWORKS:
-            addr = net.network_address.exploded
-            # TODO: use SQLAlchemy with a subquery
-            qry = Network.overlaps_with(addr, net.prefixlen)
+    def allocations():
+        qry = db.session.query(Network.id, Network.address_packed,
+                               Network.address_last, Network.owner_id)
+        with db.session.no_autoflush:
+            rows = qry.all()
+        for row in rows:
+            yield Allocation(*row)
 
-            if qry.count() == 0:
-                return addr
+    @staticmethod
+    def allocations_of(owner_ids):
+        """The allocations of the networks of owner_ids, no objects are
+        loaded."""
+        qry = db.session.query(Network.id, Network.address_packed,
+                               Network.address_last, Network.owner_id)\
+                        .filter(Network.owner_id.in_(owner_ids))
+        with db.session.no_autoflush:
+            return [Allocation(*row) for row in qry]
+
+    @staticmethod
+    def locked_allocations_of(owner_ids):
+        """The allocations of owner_ids, with their pools locked until the
+        transaction ends like for allocations."""
+        allocs = Network.allocations_of(owner_ids)
+        PoolLock.acquire((a.first, a.last) for a in allocs)
+        # read again, the pools may have changed before they were locked
+        return Network.allocations_of(owner_ids)
+
+    @staticmethod
+    def delete_owned_by(owner_ids):
+        """Deletes all networks of owner_ids with one statement."""
+        allocs = Network.locked_allocations_of(owner_ids)
+        Change.log_allocations('delete', allocs)
+        Network.query.filter(Network.owner_id.in_(owner_ids))\
+                     .delete(synchronize_session=False)
+        return len(allocs)
+
+    @staticmethod
+    def reassign_owned_by(owner_ids, owner):
+        """Gives all networks of owner_ids to owner with one statement.
+
+        Raises AssertionError, without changing anything, if a pool is
+        reserved for other owners or owner would exceed its quota.
+        """
+        allocs = Network.locked_allocations_of(owner_ids)
+        moved = {}
+        for alloc in allocs:
+            pool = pools.current.find(alloc.first, alloc.last)
+            if pool is None:
+                continue
+            pool.check(owner = owner)
+            if pool.quota is not None and alloc.owner_id != owner.id:
+                moved[pool] = moved.get(pool, 0) + alloc.last - alloc.first + 1
+        for pool, num_addresses in moved.items():
+            assert Network.used_in(owner, pool) + num_addresses <= \
+                   pool.quota, 'Quota of {} addresses in {} exceeded'.format(
+                       pool.quota, pool.network)
+
+        Change.log_allocations('update',
+            [a._replace(owner_id = owner.id) for a in allocs])
+        Network.query.filter(Network.owner_id.in_(owner_ids))\
+                     .update({ 'owner_id' : owner.id },
+                             synchronize_session=False)
+        return len(allocs)
 
-            entries = qry.all()
-            pre = entries[0]
-            used =  pre.address_packed + pre.num_addresses
-            num_addresses = get_num_addresses(prefixlen)
-            for current in entries[1:]:
-                used =  pre.address_packed + pre.num_addresses
-                if used + num_addresses < current.address_packed:
-                    break
-                else:
-                    used =  current.address_packed + current.num_addresses
-                pre = current
+    @property
+    def allocation(self):
+        return Allocation(self.id, self.address_packed, self.address_last,
+                          self.owner_id)
+
+    def conflicts(self):
+        """Returns the cidrs of other networks overlapping with this one.
+
+        The pools of the network stay locked until the transaction ends,
+        so the result holds until commit. The in-memory index rejects
+        conflicts without touching the database, a range it considers
+        free is confirmed by a query.
+
+        Raises AssertionError if the owner exceeds its quota, which is
+        checked again once the pool is locked.
+        """
+        alloc = self.allocation
+        PoolLock.acquire([(alloc.first, alloc.last)])
+        if self.owner is not None:
+            # concurrent requests may have used up the quota meanwhile
+            self.check_owner(self.owner)
+        index.sync()
+        found = [a for a in index.overlapping(alloc.first, alloc.last)
+                    if a.id != self.id]
+        if found:
+            return map(lambda a: a.cidr, found)
+
+        with db.session.no_autoflush:
+            qry = Network.overlaps_with(self.network_address, self.prefixlen)
+            if self.id is not None:
+                qry = qry.filter(Network.id != self.id)
+            found = qry.all()
+
+        if found:
+            # written by another process, reload on next use
+            index.invalidate()
+        return map(lambda n: n.cidr, found)
 
-        return ip_address(used).exploded
+    @staticmethod
+    def next_unused_network(prefixlen, ip_version=4, owner=None):
+        """Picks the lowest free network of the pools owner may use."""
+        # concurrent requests would all pick the same lowest free block,
+        # requests for other pools go on
+        PoolLock.acquire((int(n.network_address), int(n.broadcast_address))
+                         for n in pools.current.candidates(prefixlen, owner))
+        index.sync()
+        first = index.allocate(prefixlen,
+                               Network.candidates(prefixlen, owner))
+        if first is None:
+            return None
+        return ip_address(first).exploded
 
     @staticmethod
     def get(address, prefixlen = None):
@@ -162,11 +366,177 @@ class Network(db.Model):
                                        num_addresses = net.num_addresses)
 
     @staticmethod
-    def get_all(no_networks = False):
-        if no_networks:
-            return Network.query.filter(Network.num_addresses == 1)
+    def create_many(owner, items):
+        """Plans networks for many (address, prefixlen) items at once.
+
+        address None picks the next unused network. Items are checked
+        against existing networks and against each other, the database
+        confirms all of them with a few queries. Returns a (network,
+        error) tuple per item in input order. Failed networks are not
+        added to the session.
+
+        Raises ConcurrentAllocation if a picked address turns out to be
+        taken, the whole batch should be retried then.
+        """
+        results = [None] * len(items)
+        # fixed addresses first, so that picked ones can't take them
+        order = sorted(range(len(items)), key=lambda i: items[i][0] is None)
+
+        # addresses per pool taken by this batch, for the quotas
+        planned = {}
+        index.sync()
+        with index.planning() as plan:
+            for i in order:
+                address, prefixlen = items[i]
+                try:
+                    if address is None:
+                        prefixlen = 32 if prefixlen is None else int(prefixlen)
+                        first = plan.allocate(prefixlen,
+                            Network.candidates(prefixlen, owner, planned))
+                        if first is None:
+                            raise ValueError('no free network with '
+                                             'prefixlen {}'.format(prefixlen))
+                        address = ip_address(first).exploded
+                    elif prefixlen is None:
+                        prefixlen = get_max_prefixlen(address)
+                    network = Network(owner, address, int(prefixlen), planned)
+                except (AssertionError, ValueError, TypeError) as e:
+                    results[i] = (None, str(e))
+                    continue
+
+                alloc = network.allocation
+                conflicts = plan.conflicts(alloc.first, alloc.last)
+                if conflicts:
+                    msg = 'ip address conflict: {}'.format(
+                        ','.join(map(lambda a: a.cidr, conflicts)))
+                    results[i] = (network, msg)
+                    continue
+
+                plan.reserve(alloc.first, alloc.last)
+                pool = network.pool.network
+                planned[pool] = planned.get(pool, 0) + network.num_addresses
+                results[i] = (network, None)
+
+        valid = [n for n, error in results if n and error is None]
+        PoolLock.acquire((n.address_packed, n.address_last) for n in valid)
+        # the quotas were checked before the pools were locked
+        exceeded = Network.exceeded_quotas(owner, valid)
+        existing = IntervalIndex()
+        for alloc in Network.overlapping_any(valid):
+            if alloc.id not in existing.rows:
+                existing.add(alloc)
+        for i, (network, error) in enumerate(results):
+            if network and error is None:
+                pool = network.pool
+                if pool in exceeded:
+                    if items[i][0] is None:
+                        raise ConcurrentAllocation()
+                    results[i] = (network, 'Quota of {} addresses in {} '
+                        'exceeded'.format(pool.quota, pool.network))
+                    continue
+                alloc = network.allocation
+                conflicts = existing.overlapping(alloc.first, alloc.last)
+                if conflicts:
+                    # written by another process, reload on next use
+                    index.invalidate()
+                    if items[i][0] is None:
+                        raise ConcurrentAllocation()
+                    results[i] = (network, 'ip address conflict: {}'.format(
+                        ','.join(map(lambda a: a.cidr, conflicts))))
+
+        for network, error in results:
+            if network and error and network in db.session:
+                network.owner = None
+                db.session.expunge(network)
+        return [(None, error) if error else (network, None)
+                    for network, error in results]
+
+    @staticmethod
+    def exceeded_quotas(owner, networks):
+        """The pools whose quota owner would exceed with networks."""
+        added = {}
+        for network in networks:
+            pool = network.pool
+            if pool.quota is not None:
+                added[pool] = added.get(pool, 0) + network.num_addresses
+        return set(pool for pool, num_addresses in added.items()
+                    if Network.used_in(owner, pool) + num_addresses >
+                       pool.quota)
 
-        return Network.query.all()
+    @staticmethod
+    def overlapping_any(networks, chunk_size = 100):
+        """Yields allocations overlapping any of the given networks."""
+        with db.session.no_autoflush:
+            for i in range(0, len(networks), chunk_size):
+                ranges = [n.allocation for n in networks[i:i + chunk_size]]
+                qry = db.session.query(Network.id, Network.address_packed,
+                    Network.address_last, Network.owner_id).filter(or_(*[
+                        Network.overlaps_range(a.first, a.last)
+                        for a in ranges]))
+                for row in qry:
+                    yield Allocation(*row)
+
+    @staticmethod
+    def lookup(address):
+        """Returns the most specific network containing address.
+
+        Answered from the index, synced with the change log first. Changes
+        of other processes may still be missing, so the network is read
+        again and a miss is confirmed by a query.
+        """
+        packed = pack_address(address)
+        # the index syncs with the primary, a lagging replica would miss
+        # changes it has already applied
+        db.session.info['replica'] = False
+        index.sync()
+        alloc = index.lookup(packed)
+        if alloc is not None:
+            network = Network.query.get(alloc.id)
+            if network is not None and \
+               network.address_packed <= packed <= network.address_last:
+                return network
+
+        qry = Network.overlaps_with(address).order_by(Network.num_addresses)
+        return qry.first()
+
+    @staticmethod
+    def lookup_many(addresses):
+        """Resolves many addresses to their networks, in input order.
+
+        Answered from the index, synced with the change log first, with
+        one query for the owners. Returns a
+        (cidr, owner email) tuple per address, None for unknown or
+        invalid addresses.
+        """
+        packed = []
+        for address in addresses:
+            try:
+                packed.append(pack_address(address))
+            except ValueError:
+                packed.append(-1)
+
+        index.sync()
+        allocs = index.lookup_many(packed)
+        owner_ids = set(a.owner_id for a in allocs if a is not None)
+        owners = {}
+        if owner_ids:
+            qry = db.session.query(User.id, User.email)
+            owners = dict(qry.filter(User.id.in_(owner_ids)))
+
+        return map(lambda a: a and (a.cidr, owners.get(a.owner_id)), allocs)
+
+    @staticmethod
+    def get_all(no_networks = False, after = None):
+        qry = Network.query.options(db.joinedload(Network.owner))\
+                           .order_by(Network.address_packed)
+        if no_networks:
+            qry = qry.filter(Network.num_addresses == 1)
+        if after is not None:
+            # networks are stored as 32 bit integers
+            if get_max_prefixlen(after) != 32:
+                raise ValueError('{} is not an IPv4 address'.format(after))
+            qry = qry.filter(Network.address_packed > pack_address(after))
+        return qry
 
     @property
     def cidr(self):
@@ -178,8 +548,9 @@ class Network(db.Model):
 
     @network_address.setter
     def network_address(self, address):
-        self.network = gen_network(address, self.prefixlen)
-        self.address_packed = int(self.network.network_address)
+        net = gen_network(address, self.prefixlen)
+        self.address_packed = int(net.network_address)
+        self.address_last = self.address_packed + self.num_addresses - 1
 
     @property
     def prefixlen(self):
@@ -187,17 +558,51 @@ class Network(db.Model):
 
     @prefixlen.setter
     def prefixlen(self, prefixlen):
-        self.network = gen_network(self.network_address, prefixlen)
-        self.num_addresses = self.network.num_addresses
+        net = gen_network(self.network_address, prefixlen)
+        self.num_addresses = net.num_addresses
+        self.address_packed = int(net.network_address)
+        self.address_last = self.address_packed + self.num_addresses - 1
+
+    @property
+    def host_range(self):
+        """First and last usable host address, as integers."""
+        first = self.address_packed
+        last = first + self.num_addresses - 1
+        if self.num_addresses > 2:
+            return first + 1, last - 1
+        return first, last
+
+    def hosts(self, offset = 0, limit = None):
+        """Yields host addresses lazily, starting at offset."""
+        first, last = self.host_range
+        current = first + offset
+        if limit is not None:
+            last = min(last, current + limit - 1)
+        while current <= last:
+            yield ip_address(current).exploded
+            current += 1
+
+    @staticmethod
+    def url_prefix():
+        return url_for('.networks', _external=True, _method='GET')
 
-    def _address_as_dict(self, compact = True):
+    @staticmethod
+    def as_dicts(networks, **kwargs):
+        """Serializes many networks with a single url_for call.
+
+        Owners should be eager loaded by the query passed in.
+        """
+        url_prefix = Network.url_prefix()
+        return [n.as_dict(url_prefix=url_prefix, **kwargs) for n in networks]
+
+    def _address_as_dict(self, compact = True, url_prefix = None):
         ip = self.network.network_address
 
         data =  {
             'address' : ip.exploded,
             'owner' : self.owner.email,
-            'url' : url_for('.networks', address=ip.exploded, _external=True)
-
+            'url' : '{}/{}'.format(url_prefix or Network.url_prefix(),
+                                   ip.exploded)
         }
 
         if compact:
@@ -213,9 +618,9 @@ class Network(db.Model):
 
         return data
 
-    def as_dict(self, compact=True, exclude_owner=False):
+    def as_dict(self, compact=True, exclude_owner=False, url_prefix=None):
         if self.prefixlen == self.network.max_prefixlen:
-              return self._address_as_dict(compact)
+              return self._address_as_dict(compact, url_prefix)
 
         data = {
             'network'   : self.cidr,
@@ -225,15 +630,21 @@ class Network(db.Model):
             data['owner'] = self.owner.email
 
         if compact:
-            data['url'] = url_for('.networks', address=self.network_address,
-                prefixlen=self.prefixlen, _external=True, _method='GET')
+            data['url'] = '{}/{}/{}'.format(url_prefix or Network.url_prefix(),
+                self.network_address, self.prefixlen)
             return data
 
+        first_host, last_host = self.host_range
         data.update({
             'address'   : self.network_address,
             'prefixlen' : self.prefixlen,
             'netmask'   : self.network.netmask.compressed,
-            'hosts'     : map(str, self.network.hosts()),
+            'first_host': ip_address(first_host).exploded,
+            'last_host' : ip_address(last_host).exploded,
+            'num_hosts' : last_host - first_host + 1,
+            'hosts_url' : url_for('.network_hosts',
+                address=self.network_address, prefixlen=self.prefixlen,
+                _external=True),
             'broadcast' : self.network.broadcast_address.compressed,
             'is_private': self.network.is_private,
         })
@@ -242,3 +653,273 @@ class Network(db.Model):
 
     def __repr__(self):
         return 'Network({})'.format(self.network.compressed)
+
+
+pool_owners = db.Table('pool_owner',
+    db.Column('pool_id', db.Integer, db.ForeignKey('pool.id'),
+              primary_key = True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key = True))
+
+
+class Pool(db.Model):
+    """An address pool, all of them replace the POOLS config."""
+    id = db.Column(db.Integer, primary_key = True)
+    network = db.Column(db.String(64), nullable = False, unique = True)
+    min_prefixlen = db.Column(db.Integer)
+    max_prefixlen = db.Column(db.Integer)
+    # addresses per owner
+    quota = db.Column(db.BigInteger)
+    owners = db.relationship('User', secondary = pool_owners,
+                             backref = db.backref('pools', lazy = 'dynamic'))
+
+    def __init__(self, network, min_prefixlen = None, max_prefixlen = None,
+                 owners = (), quota = None):
+        self.network = ip_network(u'{}'.format(network)).exploded
+        self.min_prefixlen = min_prefixlen
+        self.max_prefixlen = max_prefixlen
+        self.owners = list(owners)
+        self.quota = quota
+
+    @property
+    def address_pool(self):
+        return AddressPool(self.network, self.min_prefixlen,
+                           self.max_prefixlen,
+                           [u.email for u in self.owners], self.quota)
+
+    def __repr__(self):
+        return '<Pool {}>'.format(self.network)
+
+
+class PoolLock(db.Model):
+    """A row per address pool, see acquire()."""
+    pool = db.Column(db.String(64), primary_key = True)
+    version = db.Column(db.Integer, nullable = False, default = 0)
+
+    @staticmethod
+    def acquire(ranges = None):
+        """Locks the pools overlapping any of the (first, last) ranges,
+        all pools if ranges is None.
+
+        Updating the row of a pool write locks it until the transaction
+        ends, so allocations within a pool are serialized across
+        processes while other pools stay available. Pools are always
+        locked in the same order, which avoids deadlocks. Does nothing
+        with ALLOCATION_LOCK disabled.
+        """
+        if not current_app.config['ALLOCATION_LOCK']:
+            return
+
+        ranges = [(0, 2 ** 32 - 1)] if ranges is None else list(ranges)
+        table = PoolLock.__table__
+        for pool in pools.current.networks:
+            first = int(pool.network_address)
+            last = int(pool.broadcast_address)
+            if not any(a <= last and first <= b for a, b in ranges):
+                continue
+
+            updated = db.session.execute(table.update()
+                .where(table.c.pool == pool.compressed)
+                .values(version = table.c.version + 1)).rowcount
+            if not updated:
+                # a concurrent insert fails the commit, which is retried
+                db.session.execute(table.insert().values(
+                    pool = pool.compressed, version = 1))
+
+    def __repr__(self):
+        return '<PoolLock {}>'.format(self.pool)
+
+
+class OutgoingMail(db.Model):
+    id = db.Column(db.Integer, primary_key = True)
+    sender = db.Column(db.String(128), nullable = False)
+    recipients = db.Column(db.Text, nullable = False)
+    subject = db.Column(db.String(256), nullable = False)
+    body = db.Column(db.Text, nullable = False)
+    created_at = db.Column(db.DateTime(), nullable = False)
+    next_attempt_at = db.Column(db.DateTime(), nullable = False)
+    attempts = db.Column(db.Integer, nullable = False, default = 0)
+    sent_at = db.Column(db.DateTime())
+    last_error = db.Column(db.String(256))
+
+    def __init__(self, msg):
+        self.sender = msg.sender
+        self.recipients = ','.join(msg.recipients)
+        self.subject = msg.subject
+        self.body = msg.body
+        self.created_at = self.next_attempt_at = datetime.utcnow()
+        self.attempts = 0
+
+    @property
+    def message(self):
+        return Message(self.subject, sender = self.sender,
+                       recipients = self.recipients.split(','),
+                       body = self.body)
+
+    @staticmethod
+    def pending(now = None):
+        max_attempts = current_app.config['MAIL_MAX_ATTEMPTS']
+        return OutgoingMail.query.filter(
+            OutgoingMail.sent_at == None,
+            OutgoingMail.attempts < max_attempts,
+            OutgoingMail.next_attempt_at <= (now or datetime.utcnow()))\
+            .order_by(OutgoingMail.id)
+
+    def __repr__(self):
+        return '<OutgoingMail {} to {}>'.format(self.id, self.recipients)
+
+
+class Change(db.Model):
+    seq = db.Column(db.Integer, primary_key = True)
+    created_at = db.Column(db.DateTime(), nullable = False)
+    table = db.Column(db.String(32), nullable = False)
+    op = db.Column(db.String(8), nullable = False)
+    object_id = db.Column(db.Integer, nullable = False)
+    data = db.Column(db.Text)
+
+    @staticmethod
+    def last_seq():
+        """The latest sequence number, a version of all users and networks."""
+        return db.session.query(db.func.max(Change.seq)).scalar() or 0
+
+    @staticmethod
+    def data_of(obj):
+        if isinstance(obj, User):
+            return { 'id' : obj.id, 'email' : obj.email,
+                     'verified' : obj.verified }
+        return { 'id' : obj.id, 'network' : obj.cidr,
+                 'owner_id' : obj.owner_id }
+
+    @staticmethod
+    def network_allocations(changes):
+        """Returns id -> Allocation or None (deleted) for the network
+        changes, the latest one of a network wins."""
+        allocs = {}
+        for change in changes:
+            if change.op == 'delete':
+                allocs[change.object_id] = None
+                continue
+            data = json.loads(change.data)
+            net = ip_network(data['network'])
+            first = int(net.network_address)
+            allocs[change.object_id] = Allocation(change.object_id, first,
+                first + net.num_addresses - 1, data['owner_id'])
+        return allocs
+
+    @staticmethod
+    def log_rows(table, op, datas):
+        """Logs op for rows written by a bulk statement, which the session
+        hooks don't see. datas are data_of() like dicts."""
+        if not datas:
+            return
+        now = datetime.utcnow()
+        # one encoder for all rows, json.dumps sets up one per call, and
+        # sorted keys would need the pure python encoder
+        encode = json.JSONEncoder().encode
+        db.session.execute(Change.__table__.insert(), [{
+            'created_at' : now, 'table' : table, 'op' : op,
+            'object_id' : data['id'], 'data' : encode(data)
+        } for data in datas])
+        db.session.info['changes_logged'] = True
+
+    @staticmethod
+    def log_allocations(op, allocs):
+        """Logs op for networks changed by a bulk statement. The index
+        applies them on commit."""
+        if not allocs:
+            return
+        Change.log_rows('network', op, [{ 'id' : a.id, 'network' : a.cidr,
+                                          'owner_id' : a.owner_id }
+                                            for a in allocs])
+
+        network_changes = db.session.info.setdefault('network_changes', {})
+        for alloc in allocs:
+            network_changes[alloc.id] = None if op == 'delete' else alloc
+
+    @staticmethod
+    def rows_for(session):
+        """Change log rows for the objects flushed by session."""
+        now = datetime.utcnow()
+        def row(obj, op):
+            return { 'created_at' : now, 'table' : obj.__tablename__,
+                     'op' : op, 'object_id' : obj.id,
+                     'data' : json.dumps(Change.data_of(obj)) }
+
+        logged = lambda obj: isinstance(obj, (User, Network))
+        rows = [row(obj, 'insert') for obj in session.new if logged(obj)]
+        rows += [row(obj, 'update') for obj in session.dirty if logged(obj)
+                    and session.is_modified(obj, include_collections=False)]
+        rows += [row(obj, 'delete') for obj in session.deleted if logged(obj)]
+        return rows
+
+    def as_dict(self):
+        return {
+            'seq' : self.seq,
+            'created_at' : self.created_at.isoformat(),
+            'table' : self.table,
+            'op' : self.op,
+            'id' : self.object_id,
+            'data' : json.loads(self.data) if self.data else None,
+        }
+
+    def __repr__(self):
+        return '<Change {} {} {} {}>'.format(self.seq, self.op, self.table,
+                                             self.object_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def log_changes(session, flush_context):
+    rows = Change.rows_for(session)
+    if rows:
+        session.execute(Change.__table__.insert(), rows)
+        session.info['changes_logged'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def track_network_changes(session, flush_context):
+    changes = session.info.setdefault('network_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Network):
+            changes[obj.id] = obj.allocation
+    for obj in session.deleted:
+        if isinstance(obj, Network):
+            changes[obj.id] = None
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_credentials(session, flush_context):
+    # new networks of a user make it dirty through the backref
+    changed = [obj for obj in session.dirty
+                if session.is_modified(obj, include_collections=False)]
+    for obj in changed + list(session.deleted):
+        if isinstance(obj, User):
+            credentials.invalidate(obj.id)
+
+
+@event.listens_for(Session, 'after_flush')
+def track_pool_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Pool):
+            session.info['pools_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def reload_pools(session):
+    if session.info.pop('pools_changed', False):
+        pools.invalidate()
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_network_changes(session):
+    network_changes = session.info.pop('network_changes', None)
+    if network_changes:
+        index.apply(network_changes)
+    if session.info.pop('changes_logged', False):
+        changes.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_network_changes(session):
+    session.info.pop('network_changes', None)
+    session.info.pop('pools_changed', None)
+    session.info.pop('changes_logged', None)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from bisect import bisect_right
+from threading import Lock
+from flask import current_app
+from ipaddress import ip_network
+
+
+class AddressPool(object):
+    """An IPv4 pool networks are allocated from.
+
+    Networks in the pool need a prefix length between min_prefixlen and
+    max_prefixlen. If owners are given, only they may allocate in it.
+    quota limits the addresses each owner holds in the pool.
+    """
+
+    def __init__(self, network, min_prefixlen = None, max_prefixlen = None,
+                 owners = None, quota = None):
+        self.network = ip_network(u'{}'.format(network))
+        # networks are stored as 32 bit integers
+        if self.network.version != 4:
+            raise ValueError('Only IPv4 pools are supported, not {}'.format(
+                self.network))
+        self.first = int(self.network.network_address)
+        self.last = int(self.network.broadcast_address)
+        self.min_prefixlen = max(min_prefixlen or 0, self.network.prefixlen)
+        self.max_prefixlen = min(max_prefixlen or self.network.max_prefixlen,
+                                 self.network.max_prefixlen)
+        self.owners = frozenset(owners or ())
+        self.quota = quota
+
+    @property
+    def key(self):
+        return (self.network, self.min_prefixlen, self.max_prefixlen,
+                self.owners, self.quota)
+
+    def allows_prefixlen(self, prefixlen):
+        return self.min_prefixlen <= prefixlen <= self.max_prefixlen
+
+    def block_size(self, prefixlen):
+        return 1 << (self.network.max_prefixlen - prefixlen)
+
+    def allows_owner(self, email):
+        return not self.owners or email in self.owners
+
+    def check(self, prefixlen = None, owner = None):
+        """Raises AssertionError if prefixlen or owner isn't allowed."""
+        if prefixlen is not None:
+            assert self.allows_prefixlen(prefixlen), \
+                'Only prefix lengths {} to {} are allowed in {}'.format(
+                    self.min_prefixlen, self.max_prefixlen, self.network)
+        if owner is not None:
+            assert self.allows_owner(owner.email), \
+                'Pool {} is reserved for other owners'.format(self.network)
+
+    def as_dict(self):
+        return {
+            'network' : self.network.exploded,
+            'min_prefixlen' : self.min_prefixlen,
+            'max_prefixlen' : self.max_prefixlen,
+            'quota' : self.quota,
+            'restricted' : bool(self.owners),
+        }
+
+    def __repr__(self):
+        return '<AddressPool {}>'.format(self.network)
+
+
+class PoolSet(object):
+    """Pools sorted by address, with lookup structures built once.
+
+    Finding the pool of a network is a binary search over the pool
+    starts, the pools allowing a prefix length are listed per length.
+    """
+
+    def __init__(self, pools):
+        self.pools = sorted(pools, key=lambda p: p.first)
+        # find() expects every address in at most one pool
+        for prev, pool in zip(self.pools, self.pools[1:]):
+            if pool.first <= prev.last:
+                raise ValueError('Pools {} and {} overlap'.format(
+                    prev.network, pool.network))
+        self.firsts = [p.first for p in self.pools]
+        self.networks = [p.network for p in self.pools]
+        self.by_prefixlen = {}
+        for pool in self.pools:
+            for prefixlen in range(pool.min_prefixlen, pool.max_prefixlen + 1):
+                self.by_prefixlen.setdefault(prefixlen, []).append(pool)
+
+    @property
+    def key(self):
+        return tuple(p.key for p in self.pools)
+
+    def find(self, first, last):
+        """The pool containing [first, last], or None."""
+        i = bisect_right(self.firsts, first) - 1
+        if i >= 0 and last <= self.pools[i].last:
+            return self.pools[i]
+        return None
+
+    def overlapping(self, first, last):
+        i = max(0, bisect_right(self.firsts, first) - 1)
+        found = []
+        for pool in self.pools[i:]:
+            if pool.first > last:
+                break
+            if pool.last >= first:
+                found.append(pool)
+        return found
+
+    def candidates(self, prefixlen, owner = None, used = None):
+        """Networks of the pools owner may allocate prefixlen from. used
+        returns the addresses owner holds in a pool, pools whose quota a
+        block of prefixlen would exceed are left out then."""
+        found = []
+        for pool in self.by_prefixlen.get(prefixlen, ()):
+            if owner is not None and not pool.allows_owner(owner.email):
+                continue
+            if used is not None and pool.quota is not None and \
+               used(pool) + pool.block_size(prefixlen) > pool.quota:
+                continue
+            found.append(pool.network)
+        return found
+
+    def __str__(self):
+        return ', '.join(str(n) for n in self.networks)
+
+
+class PoolState(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.pools = None
+        self.expires = 0
+
+
+class PoolRegistry(object):
+    """The address pools of an app.
+
+    Pools come from the pool table, or from the POOLS config while the
+    table is empty. They are reloaded after POOLS_CACHE_TTL seconds and
+    right after this process changed the table.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['pools'] = PoolState()
+
+    def load(self):
+        from .exts import db
+        from .models import Pool
+        with db.session.no_autoflush:
+            rows = Pool.query.options(db.joinedload(Pool.owners)).all()
+        if rows:
+            return PoolSet(row.address_pool for row in rows)
+        return PoolSet(AddressPool(**pool)
+                        for pool in current_app.config['POOLS'])
+
+    @property
+    def current(self):
+        """The current PoolSet, the same object as long as nothing
+        changed."""
+        state = current_app.extensions['pools']
+        if state.pools is None or state.expires < time.time():
+            with state.lock:
+                pools = self.load()
+                if state.pools is None or state.pools.key != pools.key:
+                    state.pools = pools
+                state.expires = time.time() + \
+                                current_app.config['POOLS_CACHE_TTL']
+        return state.pools
+
+    def invalidate(self):
+        current_app.extensions['pools'].expires = 0
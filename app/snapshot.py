@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+from threading import Lock
+from flask import current_app
+
+# magic, number of networks, number of owners
+HEADER = struct.Struct('<8sII')
+MAGIC = b'IPSNAP01'
+UINT32 = struct.Struct('<I')
+NO_OWNER = 0xffffffff
+
+
+def _uint32_array(values = ()):
+    arr = array('I', values)
+    assert arr.itemsize == 4
+    return arr
+
+
+def _write_uint32(f, arr):
+    if sys.byteorder != 'little':
+        arr = array('I', arr)
+        arr.byteswap()
+    arr.tofile(f)
+
+
+def write_snapshot(path, rows):
+    """Writes (first, last, owner) rows sorted by first to path.
+
+    The file has a header, the first and last addresses and an owner
+    number per network, as little endian uint32 arrays, followed by the
+    offsets and the utf-8 bytes of the owners. It is written next to path
+    and renamed, so readers never see a partial file.
+    """
+    firsts, lasts, owner_ids = _uint32_array(), _uint32_array(),\
+                               _uint32_array()
+    owners = {}
+    blob = []
+    offsets = _uint32_array([0])
+    for first, last, owner in rows:
+        firsts.append(first)
+        lasts.append(last)
+        if owner is None:
+            owner_ids.append(NO_OWNER)
+            continue
+        if owner not in owners:
+            owners[owner] = len(owners)
+            blob.append(owner.encode('utf-8'))
+            offsets.append(offsets[-1] + len(blob[-1]))
+        owner_ids.append(owners[owner])
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(firsts), len(owners)))
+        for arr in (firsts, lasts, owner_ids, offsets):
+            _write_uint32(f, arr)
+        f.write(b''.join(blob))
+    os.rename(tmp, path)
+    return len(firsts)
+
+
+def export_snapshot(path, chunk_size = 1000):
+    """Writes all networks with their owners to a snapshot at path."""
+    from .exts import db
+    from .models import Network, User
+    qry = db.session.query(Network.address_packed, Network.address_last,
+                           User.email)\
+                    .outerjoin(Network.owner)\
+                    .order_by(Network.address_packed)
+    return write_snapshot(path, qry.yield_per(chunk_size))
+
+
+class Snapshot(object):
+    """Read-only view of a snapshot file.
+
+    The file is memory-mapped and searched in place, nothing but the
+    header is read up front.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, owners = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('not a network snapshot: {}'.format(path))
+        self.firsts = HEADER.size
+        self.lasts = self.firsts + 4 * self.count
+        self.owner_ids = self.lasts + 4 * self.count
+        self.offsets = self.owner_ids + 4 * self.count
+        self.blob = self.offsets + 4 * (owners + 1)
+
+    def __len__(self):
+        return self.count
+
+    def _uint32(self, base, i):
+        return UINT32.unpack_from(self.map, base + 4 * i)[0]
+
+    def owner(self, i):
+        owner_id = self._uint32(self.owner_ids, i)
+        if owner_id == NO_OWNER:
+            return None
+        start = self.blob + self._uint32(self.offsets, owner_id)
+        end = self.blob + self._uint32(self.offsets, owner_id + 1)
+        return self.map[start:end].decode('utf-8')
+
+    def lookup(self, address):
+        """Returns (first, last, owner) of the network containing the
+        packed address, or None."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._uint32(self.firsts, mid) <= address:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        i = lo - 1
+        last = self._uint32(self.lasts, i)
+        if last < address:
+            return None
+        return self._uint32(self.firsts, i), last, self.owner(i)
+
+
+class SnapshotState(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.snapshot = None
+        self.key = None
+
+
+class SnapshotReader(object):
+    """The snapshot at SNAPSHOT_PATH, reopened when the file is replaced.
+
+    Replaced snapshots aren't closed explicitly, requests still using
+    them keep their mapping until they are done.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['snapshot'] = SnapshotState(app.config['SNAPSHOT_PATH'])
+
+    @property
+    def snapshot(self):
+        """The current Snapshot, None while there is no file."""
+        state = current_app.extensions['snapshot']
+        try:
+            stat = os.stat(state.path)
+        except OSError:
+            return state.snapshot
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if key != state.key:
+            with state.lock:
+                if key != state.key:
+                    state.snapshot = Snapshot(state.path)
+                    state.key = key
+        return state.snapshot
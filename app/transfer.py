@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import socket
+import struct
+
+from array import array
+from bisect import bisect_right
+from validate_email import validate_email
+from .exts import db, index, pools
+from .models import Change, Network, PoolLock, User
+from .utils import gen_random_hash
+
+FORMATS = ('jsonl', 'csv')
+MIMETYPES = { 'jsonl' : 'application/x-ndjson', 'csv' : 'text/csv' }
+CSV_FIELDS = ('type', 'email', 'password_hash', 'token', 'verified',
+              'network')
+# errors reported in detail, the rest are only counted
+MAX_ERRORS = 100
+IPV4 = struct.Struct('!I')
+
+
+def format_network(first, num_addresses):
+    """CIDR notation of a network from its integer columns, without
+    building an ip_network."""
+    return '{}/{}'.format(socket.inet_ntoa(IPV4.pack(first)),
+                          33 - num_addresses.bit_length())
+
+
+def parse_network(text):
+    """(first, last) of an IPv4 network in CIDR notation, like
+    ip_network() with strict checks but a lot faster. Raises ValueError."""
+    address, _, prefixlen = u'{}'.format(text).partition(u'/')
+    try:
+        packed = socket.inet_aton(address)
+    except (socket.error, UnicodeError):
+        packed = None
+    # inet_aton takes shorthand and octal addresses too
+    if packed is None or socket.inet_ntoa(packed) != address or \
+       not prefixlen.isdigit() or int(prefixlen) > 32:
+        raise ValueError(u'{} is not an IPv4 network'.format(text))
+    first, = IPV4.unpack(packed)
+    num_addresses = 1 << (32 - int(prefixlen))
+    if first & (num_addresses - 1):
+        raise ValueError(u'{} has host bits set'.format(text))
+    return first, first + num_addresses - 1
+
+
+def export_records(chunk_size = 1000):
+    """Yields a record per user, then per network sorted by address.
+
+    Users include their password hash and token, so signed api tokens
+    stay valid on an instance with the same SALT and SECRET.
+    """
+    users = db.session.query(User.email, User.password_hash, User.token,
+                             User.verified)\
+                      .order_by(User.id)
+    for email, password_hash, token, verified in users.yield_per(chunk_size):
+        yield { 'type' : 'user', 'email' : email,
+                'password_hash' : password_hash, 'token' : token,
+                'verified' : bool(verified) }
+
+    networks = db.session.query(Network.address_packed,
+                                Network.num_addresses, User.email)\
+                         .join(User, Network.owner_id == User.id)\
+                         .order_by(Network.address_packed)
+    for first, num_addresses, owner in networks.yield_per(chunk_size):
+        yield { 'type' : 'network',
+                'network' : format_network(first, num_addresses),
+                'owner' : owner }
+
+
+def encode_jsonl(records):
+    encode = json.JSONEncoder().encode
+    for record in records:
+        yield encode(record) + '\n'
+
+
+class _Row(object):
+    """File-like target of a csv writer, keeps the last row written."""
+    def write(self, line):
+        self.line = line
+
+
+def _utf8(value):
+    return value.encode('utf-8') if isinstance(value, type(u'')) else value
+
+
+def encode_csv(records):
+    row = _Row()
+    writer = csv.writer(row, lineterminator='\n')
+    writer.writerow(CSV_FIELDS)
+    yield row.line
+    for record in records:
+        if record['type'] == 'network':
+            values = ('network', record['owner'], '', '', '',
+                      record['network'])
+        else:
+            values = ('user', record['email'], record['password_hash'],
+                      record['token'] or '', int(record['verified']), '')
+        writer.writerow([_utf8(v) for v in values])
+        yield row.line
+
+
+def decode_jsonl(lines):
+    """Yields a record per line, None for lines that aren't one."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def decode_csv(lines):
+    """Yields the records of CSV lines written by encode_csv, None for
+    rows that don't match the header."""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(header):
+            yield None
+            continue
+        values = dict(zip(header, (v.decode('utf-8') for v in row)))
+        if values.get('type') == 'network':
+            yield { 'type' : 'network', 'network' : values.get('network'),
+                    'owner' : values.get('email') }
+        else:
+            values['verified'] = values.get('verified') in (u'1', u'true')
+            yield values
+
+
+ENCODERS = { 'jsonl' : encode_jsonl, 'csv' : encode_csv }
+DECODERS = { 'jsonl' : decode_jsonl, 'csv' : decode_csv }
+
+
+def encode(fmt, records):
+    return ENCODERS[fmt](records)
+
+
+def decode(fmt, lines):
+    return DECODERS[fmt](lines)
+
+
+class RangeList(object):
+    """Disjoint address ranges sorted by their first address.
+
+    The ranges are kept in two arrays. Adding ranges in order appends to
+    them, so building the list from sorted rows costs a binary search per
+    range.
+    """
+
+    def __init__(self, ranges = ()):
+        self.firsts = array('L')
+        self.lasts = array('L')
+        for first, last in ranges:
+            self.add(first, last)
+
+    def __len__(self):
+        return len(self.firsts)
+
+    def overlaps(self, first, last):
+        i = bisect_right(self.firsts, last)
+        return i > 0 and self.lasts[i - 1] >= first
+
+    def add(self, first, last):
+        i = bisect_right(self.firsts, last)
+        self.firsts.insert(i, first)
+        self.lasts.insert(i, last)
+
+
+class Importer(object):
+    """Inserts exported records in chunks of Core inserts.
+
+    Users whose email exists already are kept as they are. Networks are
+    checked against the pools and against a RangeList of the existing
+    networks and one of the imported networks, instead of a query each.
+    Owner restrictions of the pools apply, quotas don't.
+    """
+
+    def __init__(self, chunk_size = 500):
+        self.chunk_size = chunk_size
+        self.pool_set = pools.current
+        PoolLock.acquire()
+        with db.session.no_autoflush:
+            self.emails = dict(db.session.query(User.email, User.id))
+            existing = db.session.query(Network.address_packed,
+                                        Network.address_last)\
+                                 .order_by(Network.address_packed)
+            self.existing = RangeList(existing.yield_per(10000))
+        self.imported = RangeList()
+        self.users = []
+        self.networks = []
+        self.stats = { 'users' : 0, 'networks' : 0, 'skipped_users' : 0,
+                       'failed' : 0, 'errors' : [] }
+
+    def error(self, number, message):
+        self.stats['failed'] += 1
+        if len(self.stats['errors']) < MAX_ERRORS:
+            self.stats['errors'].append({ 'record' : number,
+                                          'error' : message })
+
+    def add_user(self, record):
+        email = record.get('email')
+        if email in self.emails:
+            self.stats['skipped_users'] += 1
+            return
+        assert email and validate_email(email), 'Invalid email'
+        assert record.get('password_hash'), 'Missing password hash'
+        self.emails[email] = None
+        self.users.append({ 'email' : email,
+                            'password_hash' : record['password_hash'],
+                            'token' : record.get('token') or
+                                      gen_random_hash(32),
+                            'verified' : bool(record.get('verified')) })
+        if len(self.users) >= self.chunk_size:
+            self.flush_users()
+
+    def add_network(self, record):
+        owner = record.get('owner')
+        assert owner in self.emails, u'Unknown owner {}'.format(owner)
+        network = record.get('network')
+        try:
+            first, last = parse_network(network)
+        except ValueError as e:
+            raise AssertionError(*e.args)
+        pool = self.pool_set.find(first, last)
+        assert pool is not None, \
+            'Only subnetworks of the following networks are allowed {}'\
+                .format(self.pool_set)
+        pool.check(prefixlen = 33 - (last - first + 1).bit_length())
+        assert pool.allows_owner(owner), \
+            'Pool {} is reserved for other owners'.format(pool.network)
+        assert not self.existing.overlaps(first, last) and \
+               not self.imported.overlaps(first, last), \
+            u'Network {} overlaps an existing network'.format(network)
+
+        if self.users:
+            self.flush_users()
+        self.imported.add(first, last)
+        self.networks.append({ 'address_packed' : first,
+                               'address_last' : last,
+                               'num_addresses' : last - first + 1,
+                               'owner_id' : self.emails[owner] })
+        if len(self.networks) >= self.chunk_size:
+            self.flush_networks()
+
+    def flush_users(self):
+        db.session.execute(User.__table__.insert(), self.users)
+        emails = [u['email'] for u in self.users]
+        rows = db.session.query(User.id, User.email, User.verified)\
+                         .filter(User.email.in_(emails)).all()
+        Change.log_rows('user', 'insert', [{ 'id' : id, 'email' : email,
+                                             'verified' : verified }
+                                              for id, email, verified in rows])
+        for id, email, _ in rows:
+            self.emails[email] = id
+        self.stats['users'] += len(self.users)
+        self.users = []
+
+    def flush_networks(self):
+        db.session.execute(Network.__table__.insert(), self.networks)
+        firsts = [n['address_packed'] for n in self.networks]
+        rows = db.session.query(Network.id, Network.address_packed,
+                                Network.num_addresses, Network.owner_id)\
+                         .filter(Network.address_packed.in_(firsts))
+        Change.log_rows('network', 'insert', [{ 'id' : id,
+            'network' : format_network(first, num_addresses),
+            'owner_id' : owner_id } for id, first, num_addresses, owner_id
+                                        in rows])
+        self.stats['networks'] += len(self.networks)
+        self.networks = []
+
+    def run(self, records):
+        """Imports records and commits once at the end. Returns counts
+        and the first MAX_ERRORS errors, by record number."""
+        for number, record in enumerate(records, 1):
+            try:
+                kind = record and record.get('type')
+                if kind == 'user':
+                    self.add_user(record)
+                elif kind == 'network':
+                    self.add_network(record)
+                else:
+                    raise AssertionError('Invalid record')
+            except AssertionError as e:
+                self.error(number, e.args[0] if e.args else 'Invalid')
+        if self.users:
+            self.flush_users()
+        if self.networks:
+            self.flush_networks()
+        db.session.commit()
+        # too many changes to apply one by one
+        index.invalidate()
+        return self.stats
+
+
+def import_records(records, chunk_size = 500):
+    return Importer(chunk_size).run(records)
@@ -3,10 +3,17 @@
 import string
 
 from ipaddress import ip_address, ip_network
-from hashlib import sha256
+from hashlib import sha1, sha256
 from random import choice
 from functools import wraps
-from flask import request, abort
+from flask import request, abort, json, g, make_response, jsonify,\
+                  current_app
+from sqlalchemy.exc import IntegrityError, OperationalError
+from cache import LRUCache
+
+# bounds the networks memoized by gen_network_packed
+NETWORK_CACHE_SIZE = 65536
+_networks = LRUCache(NETWORK_CACHE_SIZE)
 
 def get_factors_by(factor, num):
     amount_num_factors = 0
@@ -32,20 +39,143 @@ def hash_password(salt, password):
 def gen_network( address, prefixlen):
     return ip_network(u'{}/{}'.format(address, prefixlen), strict=False)
 
+def gen_network_packed(address_packed, num_addresses):
+    """The network of num_addresses starting at address_packed.
+
+    Networks are immutable, so they are memoized per (address_packed,
+    num_addresses) in a bounded LRU cache.
+    """
+    key = (address_packed, num_addresses)
+    network = _networks.get(key)
+    if network is None:
+        max_prefixlen = ip_address(address_packed).max_prefixlen
+        prefixlen = get_prefix_len(max_prefixlen, num_addresses)
+        network = ip_network((address_packed, prefixlen), strict=False)
+        _networks.put(key, network)
+    return network
+
+def pack_address(address):
+    return int(ip_address(u'{}'.format(address)))
+
 def get_max_prefixlen(address):
     addr = ip_address(address)
     return addr.max_prefixlen
 
+def flag_arg(name):
+    """A boolean query argument, only 1 and true turn it on."""
+    return request.args.get(name, '').lower() in ('1', 'true')
+
 def gen_random_hash(length):
     digits = string.ascii_letters + string.digits
     return ''.join(choice(digits) for x in range(length))
 
 def requires_auth(f):
-    from models import User
+    from exts import credentials, metrics
     @wraps(f)
     def decorated(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            with metrics.timed('auth_duration_seconds', method='token'):
+                ok = credentials.authenticate_token(header[len('Bearer '):])
+            if not ok:
+                abort(401)
+            return f(*args, **kwargs)
+
         auth = request.authorization
-        if not auth or not User.auth(auth.username, auth.password):
+        if not auth:
+            abort(401)
+        with metrics.timed('auth_duration_seconds', method='basic'):
+            ok = credentials.authenticate(auth.username, auth.password)
+        if not ok:
             abort(401)
         return f(*args, **kwargs)
     return decorated
+
+def requires_admin(f):
+    """Like requires_auth, for users listed in ADMINS only."""
+    @requires_auth
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if g.user.email not in current_app.config['ADMINS']:
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated
+
+def cached_response(per_user = False):
+    """Caches GET responses per version of the change log.
+
+    The version makes a strong ETag, so clients get a 304 as long as no
+    user or network has changed. Use per_user for responses that depend
+    on the authenticated user.
+    """
+    def decorator(f):
+        from exts import responses
+        from models import Change
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = (Change.last_seq(), request.host_url, request.path,
+                   tuple(sorted(request.args.items(multi=True))),
+                   g.user.id if per_user else None)
+            etag = sha1(repr(key)).hexdigest()
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            cached = responses.get(key)
+            if cached is not None:
+                data, mimetype = cached
+                response = make_response(data)
+                response.mimetype = mimetype
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                responses.put(key, response.get_data(), response.mimetype)
+
+            response.set_etag(etag)
+            return response
+        return decorated
+    return decorator
+
+def retry_allocation(f):
+    """Runs f again when a concurrent request allocated the same addresses.
+
+    This shows up as a ConcurrentAllocation, or as a failed commit
+    (unique network address, lock timeout) if the pool lock is disabled.
+    Gives up with a 409 after ALLOCATION_RETRIES retries.
+    """
+    from exts import db
+    from models import ConcurrentAllocation
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        for attempt in range(current_app.config['ALLOCATION_RETRIES'] + 1):
+            try:
+                return f(*args, **kwargs)
+            except (ConcurrentAllocation, IntegrityError, OperationalError):
+                db.session.rollback()
+        msg = 'concurrent allocation, please try again'
+        return make_response(jsonify( { 'error' : msg } ), 409)
+    return decorated
+
+def reads_from_replica(f):
+    """Sends the reads of f to the replica bind, if there is one.
+
+    Once f writes, the rest of it reads from the primary again.
+    """
+    from exts import db
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        db.session.info['replica'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('replica', None)
+    return decorated
+
+def stream_json_list(key, items):
+    """Encodes {key: [items]} chunk by chunk."""
+    yield '{{"{}": ['.format(key)
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item)
+    yield ']}'
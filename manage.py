@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from flask.ext.script import Manager
+import json
+import sys
+
+from flask.ext.script import Manager, Command, Option
 from flask.ext.migrate import MigrateCommand
 from app import create_app
-from app.exts import db
+from app.exts import db, pools
+from app.models import Network, Pool, User
+from app.allocator import compaction_plan
+from app.pools import PoolSet
+from app.mailer import MailWorker
+from app.bench import sqlite_profiles, run_suite
+from app.snapshot import export_snapshot
+from app.transfer import FORMATS, encode, decode, export_records,\
+                         import_records
+from app.utils import gen_network_packed
 
 app = create_app()
 
@@ -16,6 +28,142 @@ def resetdb():
     db.drop_all()
     db.create_all()
 
+@manager.command
+def mailworker():
+    """Sends queued mails until interrupted."""
+    worker = MailWorker(app)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(1)
+    except KeyboardInterrupt:
+        worker.stop()
+
+@manager.option('-p', '--processes', type=int, default=4)
+@manager.option('-d', '--duration', type=float, default=5)
+@manager.option('-w', '--write-ratio', dest='write_ratio', type=float,
+                default=0.1)
+def benchsqlite(processes, duration, write_ratio):
+    """Compares mixed read/write throughput of the SQLite settings."""
+    results = sqlite_profiles(processes=processes, duration=duration,
+                              write_ratio=write_ratio)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+@manager.option('-s', '--sizes', default='1000,10000,100000',
+                help='comma separated numbers of seeded networks')
+@manager.option('-n', '--requests', type=int, default=200,
+                help='requests per endpoint and size')
+@manager.option('--production', action='store_true',
+                help='use the production SQLite settings')
+@manager.option('-o', '--output', help='write the JSON results to a file')
+def bench(sizes, requests, production, output):
+    """Benchmarks allocation, lookup, listing and auth at scale."""
+    results = run_suite(sizes=[int(s) for s in sizes.split(',')],
+                        requests=requests, production=production)
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+
+@manager.option('-o', '--output', help='defaults to SNAPSHOT_PATH')
+def snapshot(output):
+    """Exports all networks and owners for the lookup app."""
+    path = output or app.config['SNAPSHOT_PATH']
+    count = export_snapshot(path)
+    print('{} networks written to {}'.format(count, path))
+
+@manager.option('network')
+@manager.option('--min-prefixlen', dest='min_prefixlen', type=int)
+@manager.option('--max-prefixlen', dest='max_prefixlen', type=int)
+@manager.option('-q', '--quota', type=int, help='addresses per owner')
+@manager.option('-o', '--owners', help='comma separated emails, '
+                'everyone may allocate if not given')
+def addpool(network, min_prefixlen, max_prefixlen, quota, owners):
+    """Adds an address pool. Once there are pools in the database, the
+    POOLS config is ignored."""
+    emails = owners.split(',') if owners else []
+    users = User.query.filter(User.email.in_(emails)).all() if emails else []
+    if len(users) != len(emails):
+        print('unknown owners: {}'.format(', '.join(
+            set(emails) - set(u.email for u in users))))
+        return
+    existing = [p.address_pool for p in Pool.query]
+    try:
+        pool = Pool(network, min_prefixlen, max_prefixlen, users, quota)
+        PoolSet(existing + [pool.address_pool])
+    except ValueError as e:
+        db.session.rollback()
+        print(e)
+        return
+    db.session.add(pool)
+    db.session.commit()
+
+@manager.option('network')
+def removepool(network):
+    """Removes an address pool without networks."""
+    pool = Pool.query.filter_by(network = network).first()
+    if pool is None:
+        print('no pool {}'.format(network))
+        return
+    address_pool = pool.address_pool
+    used = Network.query.filter(
+        Network.overlaps_range(address_pool.first, address_pool.last)).count()
+    if used:
+        print('{} networks left in {}'.format(used, network))
+        return
+    db.session.delete(pool)
+    db.session.commit()
+
+@manager.option('-p', '--prefixlen', type=int, default=22,
+                help='size of the blocks to free')
+@manager.option('-n', '--count', type=int, default=1,
+                help='number of blocks to free')
+def compactionplan(prefixlen, count):
+    """Suggests networks to move so that aligned blocks become free."""
+    plan = compaction_plan(pools.current.networks, Network.allocations(),
+                           prefixlen, count)
+    results = [{
+        'block' : gen_network_packed(first, last - first + 1).exploded,
+        'moves' : [{ 'id' : alloc.id, 'network' : alloc.cidr,
+                     'to' : moved.cidr } for alloc, moved in moves],
+    } for (first, last), moves in plan]
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+@manager.option('-f', '--format', dest='fmt', choices=FORMATS,
+                default='jsonl')
+@manager.option('-o', '--output', help='defaults to stdout')
+def export(fmt, output):
+    """Streams all users, with their password hashes, and networks."""
+    f = open(output, 'wb') if output else sys.stdout
+    try:
+        for chunk in encode(fmt, export_records()):
+            f.write(chunk)
+    finally:
+        if output:
+            f.close()
+
+class Import(Command):
+    """Imports users and networks written by export."""
+
+    option_list = (
+        Option('path', help='- reads stdin'),
+        Option('-f', '--format', dest='fmt', choices=FORMATS,
+               default='jsonl'),
+    )
+
+    def run(self, path, fmt):
+        f = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            stats = import_records(decode(fmt, f))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        print(json.dumps(stats, indent=2, sort_keys=True))
+
+manager.add_command('import', Import())
+
 if __name__ == '__main__':
     manager.run()
 
@@ -0,0 +1,38 @@
+"""network owner on delete cascade
+
+Revision ID: 5a1c7e9d2b40
+Revises: 360ebdbb1d9f
+Create Date: 2026-10-18 10:02:13.418532
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a1c7e9d2b40'
+down_revision = '360ebdbb1d9f'
+
+from alembic import op
+
+# the initial schema left the constraint unnamed, batch mode names it
+# when it copies the table on SQLite
+NAMING = { 'fk' : 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s' }
+
+
+def constraint_name():
+    if op.get_bind().dialect.name == 'postgresql':
+        return 'network_owner_id_fkey'
+    return 'fk_network_owner_id_user'
+
+
+def upgrade():
+    name = constraint_name()
+    with op.batch_alter_table('network', naming_convention=NAMING) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'user', ['owner_id'], ['id'],
+                                    ondelete='CASCADE')
+
+
+def downgrade():
+    name = constraint_name()
+    with op.batch_alter_table('network', naming_convention=NAMING) as batch_op:
+        batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.create_foreign_key(name, 'user', ['owner_id'], ['id'])
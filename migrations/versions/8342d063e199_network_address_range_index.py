@@ -0,0 +1,30 @@
+"""network address range index
+
+Revision ID: 8342d063e199
+Revises: 12dc5f208bf1
+Create Date: 2026-10-18 09:08:43.360238
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8342d063e199'
+down_revision = '12dc5f208bf1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('network', sa.Column('address_last', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE network SET address_last = address_packed + num_addresses - 1')
+    with op.batch_alter_table('network') as batch_op:
+        batch_op.alter_column('address_last', existing_type=sa.BigInteger(), nullable=False)
+    op.create_index('ix_network_address_range', 'network', ['address_packed', 'address_last'], unique=False)
+    op.create_index(op.f('ix_network_owner_id'), 'network', ['owner_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_network_owner_id'), table_name='network')
+    op.drop_index('ix_network_address_range', table_name='network')
+    with op.batch_alter_table('network') as batch_op:
+        batch_op.drop_column('address_last')
@@ -3,6 +3,8 @@
 import base64
 import re
 
+from contextlib import contextmanager
+from sqlalchemy import event
 from flask.ext.testing import TestCase
 from flask.testing import FlaskClient
 from app.models import User, Network
@@ -53,12 +55,29 @@ class BaseCase(TestCase):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite://"
+    MAIL_QUEUE = False
+    # keeps the queries of cached logins the same during a test
+    AUTH_CACHE_SYNC_INTERVAL = 60
 
     def create_app(self):
         app =  create_app(self)
         app.test_client_class = TestClient
         return app
 
+    @contextmanager
+    def count_queries(self):
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                before_cursor_execute)
+
     def _extract_url(self, msg):
         return re.search("(?P<url>https?://[^\s]+)", msg).group("url")
 
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from app.exts import db, pools
+from app.models import Network, PoolLock, User
+from tests import TestCase, AUTH, EXISTING_USER_EMAIL
+
+ADMIN_AUTH = (u'admin@bar.de', u'admin123')
+OTHER_EMAIL = u'foo@bar.de'
+
+
+class TestAdmin(TestCase):
+    ADMINS = [ADMIN_AUTH[0]]
+
+    def setUp(self):
+        super(TestAdmin, self).setUp()
+        for email, password in (ADMIN_AUTH, (OTHER_EMAIL, u'foobar')):
+            user = User(email, password)
+            user.verified = True
+            db.session.add(user)
+        db.session.commit()
+
+    def post(self, url, auth = ADMIN_AUTH, **data):
+        return self.client.post(url, auth = auth, data = json.dumps(data),
+                                content_type = 'application/json')
+
+    def owner_of(self, address):
+        return Network.lookup(address).owner.email
+
+    def test_requires_admin(self):
+        response = self.post('/admin/networks/delete', AUTH,
+                             owners = [EXISTING_USER_EMAIL])
+        self.assert403(response)
+        self.assertEqual(2, Network.query.count())
+
+    def test_unknown_users(self):
+        self.assert400(self.post('/admin/networks/delete',
+                                 owners = [u'nobody@bar.de']))
+        self.assert400(self.post('/admin/networks/reassign',
+            owners = [EXISTING_USER_EMAIL], to = u'nobody@bar.de'))
+        self.assert400(self.post('/admin/users/delete', users = 'foo'))
+
+    def pool_lock_version(self, pool = u'192.168.0.0/16'):
+        lock = PoolLock.query.get(pool)
+        return lock.version if lock else 0
+
+    def test_delete_networks(self):
+        version = self.pool_lock_version()
+        response = self.post('/admin/networks/delete',
+                             owners = [EXISTING_USER_EMAIL, OTHER_EMAIL])
+        self.assert200(response)
+        self.assertLess(version, self.pool_lock_version())
+        self.assertEqual(2, response.json['deleted'])
+        self.assertEqual(0, Network.query.count())
+        self.assertEqual(3, User.query.count())
+        self.assertIsNone(Network.lookup(u'192.168.0.1'))
+
+    def test_reassign_networks(self):
+        response = self.post('/admin/networks/reassign',
+                             owners = [EXISTING_USER_EMAIL], to = OTHER_EMAIL)
+        self.assert200(response)
+        self.assertEqual(2, response.json['reassigned'])
+        self.assertEqual(OTHER_EMAIL, self.owner_of(u'192.168.0.1'))
+
+        changes = self.client.get('/changes?since=0', auth = AUTH).json
+        self.assertEqual(dict(id=1, network='192.168.0.0/26', owner_id=3),
+                         changes['changes'][-2]['data'])
+
+    def test_reassign_into_restricted_pool(self):
+        self.app.config['POOLS'] = [
+            { 'network' : '192.168.0.0/16', 'quota' : 64,
+              'owners' : [EXISTING_USER_EMAIL, OTHER_EMAIL] }]
+        pools.invalidate()
+        response = self.post('/admin/networks/reassign',
+                             owners = [EXISTING_USER_EMAIL], to = OTHER_EMAIL)
+        self.assert400(response)
+        self.assertIn('Quota', response.json['error'])
+
+        response = self.post('/admin/networks/reassign',
+            owners = [EXISTING_USER_EMAIL], to = ADMIN_AUTH[0])
+        self.assert400(response)
+        self.assertIn('reserved', response.json['error'])
+        self.assertEqual(EXISTING_USER_EMAIL, self.owner_of(u'192.168.0.1'))
+
+    def test_delete_users(self):
+        response = self.post('/admin/users/delete',
+                             users = [EXISTING_USER_EMAIL, OTHER_EMAIL])
+        self.assert200(response)
+        self.assertEqual(dict(message='success', deleted=2, networks=2),
+                         response.json)
+        self.assertEqual(0, Network.query.count())
+        self.assertEqual([ADMIN_AUTH[0]], [u.email for u in User.query])
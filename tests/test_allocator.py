@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from ipaddress import ip_network, ip_address
+from app.allocator import BuddyPool, compaction_plan
+from app.index import Allocation
+
+POOL = ip_network(u'10.0.0.0/24')
+
+def packed(address):
+    return int(ip_address(address))
+
+class TestBuddyPool(TestCase):
+    def setUp(self):
+        self.pool = BuddyPool(POOL)
+
+    def test_allocate_empty_pool(self):
+        self.assertEqual(packed(u'10.0.0.0'), self.pool.allocate(26))
+
+    def test_allocate_respects_alignment(self):
+        self.assertTrue(self.pool.reserve(packed(u'10.0.0.1'), 32))
+        self.assertEqual(packed(u'10.0.0.2'), self.pool.allocate(31))
+        self.assertEqual(packed(u'10.0.0.4'), self.pool.allocate(30))
+        self.assertEqual(packed(u'10.0.0.128'), self.pool.allocate(25))
+
+    def test_allocate_outside_pool_prefixlens(self):
+        self.assertEqual(None, self.pool.allocate(16))
+        self.assertEqual(None, self.pool.allocate(33))
+
+    def test_release_merges_buddies(self):
+        self.pool.reserve(packed(u'10.0.0.0'), 25)
+        self.pool.reserve(packed(u'10.0.0.128'), 25)
+        self.assertEqual(None, self.pool.allocate(24))
+        self.assertTrue(self.pool.release(packed(u'10.0.0.0'), 25))
+        self.assertTrue(self.pool.release(packed(u'10.0.0.128'), 25))
+        self.assertEqual(packed(u'10.0.0.0'), self.pool.allocate(24))
+        self.assertFalse(self.pool.release(packed(u'10.0.0.0'), 25))
+
+    def test_reserve_used_block(self):
+        self.assertTrue(self.pool.reserve(packed(u'10.0.0.0'), 26))
+        self.assertFalse(self.pool.reserve(packed(u'10.0.0.4'), 30))
+
+    def test_stats(self):
+        stats = self.pool.stats()
+        self.assertEqual((256, 0, 24, 0.0), (stats['free'], stats['used'],
+            stats['largest_free_prefixlen'], stats['fragmentation']))
+
+        self.pool.reserve(packed(u'10.0.0.1'), 32)
+        stats = self.pool.stats()
+        self.assertEqual((255, 1, 25), (stats['free'], stats['used'],
+            stats['largest_free_prefixlen']))
+        self.assertEqual(round(1 - 128.0 / 255, 4), stats['fragmentation'])
+        prefixes = dict((p['prefixlen'], p) for p in stats['prefixes'])
+        self.assertEqual(dict(prefixlen=25, free_blocks=1, allocatable=1),
+                         prefixes[25])
+        self.assertEqual(0, prefixes[24]['allocatable'])
+        self.assertEqual(255, prefixes[32]['allocatable'])
+
+        self.pool.release(packed(u'10.0.0.1'), 32)
+        self.assertEqual(256, self.pool.stats()['free'])
+
+
+def alloc(id, address, prefixlen):
+    first = packed(address)
+    return Allocation(id, first, first + 2 ** (32 - prefixlen) - 1, 1)
+
+
+class TestCompactionPlan(TestCase):
+    def test_moves_fewest_addresses(self):
+        allocs = [alloc(1, u'10.0.0.0', 28), alloc(2, u'10.0.0.64', 26),
+                  alloc(3, u'10.0.0.128', 30)]
+        plan = compaction_plan([POOL], allocs, 25)
+        self.assertEqual([((packed(u'10.0.0.128'), packed(u'10.0.0.255')),
+                           [(allocs[2], alloc(3, u'10.0.0.16', 30))])], plan)
+
+    def test_moves_within_pool(self):
+        other = ip_network(u'192.168.0.0/24')
+        allocs = [alloc(1, u'192.168.0.0', 26), alloc(2, u'192.168.0.128', 30)]
+        plan = compaction_plan([POOL, other], allocs, 25)
+        block = (packed(u'192.168.0.128'), packed(u'192.168.0.255'))
+        self.assertEqual([(block, [(allocs[1],
+                                    alloc(2, u'192.168.0.64', 30))])], plan)
+
+        allocs = [alloc(1, u'192.168.0.0', 25), alloc(2, u'192.168.0.128', 30)]
+        self.assertEqual([], compaction_plan([POOL, other], allocs, 25))
+
+    def test_no_room(self):
+        allocs = [alloc(1, u'10.0.0.0', 26), alloc(2, u'10.0.0.64', 26),
+                  alloc(3, u'10.0.0.128', 26), alloc(4, u'10.0.0.192', 27)]
+        self.assertEqual([], compaction_plan([POOL], allocs, 25))
+        self.assertEqual([], compaction_plan([POOL], allocs, 26))
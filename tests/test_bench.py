@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from ipaddress import ip_network
+from app.bench import run_suite, seed_networks, percentile
+
+
+class TestBench(TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(51, percentile(values, 50))
+        self.assertEqual(100, percentile(values, 99))
+        self.assertEqual(100, percentile(values, 100))
+        self.assertIsNone(percentile([], 50))
+
+    def test_seed_networks_round_robin(self):
+        addresses = seed_networks([ip_network(u'10.0.0.0/8'),
+            ip_network(u'172.16.0.0/12'), ip_network(u'192.168.0.0/16')])
+        self.assertEqual([0x0a000000, 0xac100000, 0xc0a80000, 0x0a000020],
+            [next(addresses) for i in range(4)])
+
+    def test_run_suite(self):
+        results = run_suite(sizes = (20, 10), requests = 3)
+        self.assertEqual(['10', '20'], sorted(results['sizes']))
+        for size in results['sizes'].values():
+            for name in ('allocate_next_unused', 'allocate_address',
+                         'lookup_address', 'list_page', 'auth_basic',
+                         'auth_token'):
+                self.assertEqual({ '200' : 3 }, size[name]['statuses'])
+                self.assertGreater(size[name]['queries_per_request'], 0)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from app.models import Change
+from tests import TestCase, AUTH, EXISTING_USER_EMAIL
+
+class TestChanges(TestCase):
+    def test_initial_changes(self):
+        response = self.client.get('/changes', auth = AUTH)
+        self.assert200(response)
+        changes = response.json['changes']
+        self.assertEqual(['network', 'network', 'user'],
+            sorted(map(lambda c: c['table'], changes)))
+        self.assertEqual(set(['insert']), set(map(lambda c: c['op'], changes)))
+        user = [c for c in changes if c['table'] == 'user'][0]
+        self.assertEqual(user['data']['email'], EXISTING_USER_EMAIL)
+        self.assertEqual(response.json['last_seq'], changes[-1]['seq'])
+
+    def test_changes_since(self):
+        since = self.client.get('/changes', auth = AUTH).json['last_seq']
+        self.client.delete('/networks/192.168.0.0/26', auth = AUTH)
+        self.client.post('/networks', auth = AUTH, data=dict(
+            address='10.0.0.0', prefixlen=24))
+
+        response = self.client.get('/changes?since={}'.format(since),
+            auth = AUTH)
+        self.assertEqual([('delete', '192.168.0.0/26'), ('insert', '10.0.0.0/24')],
+            map(lambda c: (c['op'], c['data']['network']),
+                response.json['changes']))
+
+        last_seq = response.json['last_seq']
+        response = self.client.get('/changes?since={}&wait=0.1'.format(last_seq),
+            auth = AUTH)
+        self.assertEqual(response.json, dict(changes=[], last_seq=last_seq))
+
+    def test_other_users_hidden(self):
+        self.client.post('/user', data = dict(email = 'foo@bar.de',
+                                              password = 'foobar123'))
+        response = self.client.get('/changes', auth = AUTH)
+        emails = [c['data']['email'] for c in response.json['changes']
+                  if c['table'] == 'user']
+        self.assertEqual([EXISTING_USER_EMAIL], emails)
+        # the hidden row still advances last_seq
+        self.assertEqual(Change.query.order_by(Change.seq.desc()).first().seq,
+                         response.json['last_seq'])
+
+
+class TestAdminChanges(TestCase):
+    ADMINS = [EXISTING_USER_EMAIL]
+
+    def test_admin_sees_all_users(self):
+        self.client.post('/user', data = dict(email = 'foo@bar.de',
+                                              password = 'foobar123'))
+        response = self.client.get('/changes', auth = AUTH)
+        emails = [c['data']['email'] for c in response.json['changes']
+                  if c['table'] == 'user']
+        self.assertEqual([EXISTING_USER_EMAIL, 'foo@bar.de'], emails)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from threading import Thread
+from app.models import Network
+from app import create_app
+from tests import EmptyTestCase, TestClient, AUTH
+
+
+class TestConcurrentAllocation(EmptyTestCase):
+    """Parallel allocations of several workers on one SQLite file.
+
+    Every worker is an app of its own, so it has its own index like a
+    separate process would.
+    """
+
+    WORKERS = 3
+    THREADS_PER_WORKER = 3
+    REQUESTS_PER_THREAD = 6
+    ALLOCATION_RETRIES = 10
+
+    def create_app(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.db_path
+        return super(TestConcurrentAllocation, self).create_app()
+
+    def tearDown(self):
+        super(TestConcurrentAllocation, self).tearDown()
+        os.remove(self.db_path)
+
+    def _workers(self):
+        workers = []
+        for i in range(self.WORKERS):
+            app = create_app(self)
+            app.test_client_class = TestClient
+            # the first request builds the URL map, which isn't safe to
+            # do from several threads at once
+            app.test_client().get('/user', auth = AUTH)
+            workers.append(app)
+        return workers
+
+    def _run_parallel(self, requests):
+        """Runs requests(client) in THREADS_PER_WORKER threads per worker,
+        returns the status codes of all responses."""
+        results = []
+        def run(app):
+            results.extend(requests(app.test_client()))
+
+        threads = [Thread(target=run, args=(app,))
+                    for app in self._workers()
+                    for i in range(self.THREADS_PER_WORKER)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def assertNoOverlaps(self):
+        networks = Network.query.order_by(Network.address_packed).all()
+        for a, b in zip(networks, networks[1:]):
+            self.assertLess(a.address_last, b.address_packed,
+                '{} overlaps {}'.format(a, b))
+
+    def test_parallel_next_unused_network(self):
+        def requests(client):
+            for i in range(self.REQUESTS_PER_THREAD):
+                yield client.post('/networks', auth = AUTH, data=dict(
+                    prefixlen=(28, 26, 30)[i % 3])).status_code
+
+        results = self._run_parallel(requests)
+        total = self.WORKERS * self.THREADS_PER_WORKER * \
+                self.REQUESTS_PER_THREAD
+        self.assertEqual([200] * total, results)
+        self.assertEqual(total, Network.query.count())
+        self.assertNoOverlaps()
+
+    def test_parallel_same_network(self):
+        def requests(client):
+            for prefixlen in (24, 26, 28):
+                yield client.post('/networks', auth = AUTH, data=dict(
+                    address='10.1.0.0', prefixlen=prefixlen)).status_code
+
+        results = self._run_parallel(requests)
+        self.assertEqual(1, results.count(200))
+        self.assertEqual(len(results) - 1, results.count(400))
+        self.assertEqual(1, Network.query.count())
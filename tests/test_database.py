@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+
+from sqlalchemy.pool import QueuePool
+from app.config import SQLiteProductionConfig
+from app.exts import db
+from tests import BaseCase
+
+
+class TestSQLiteProduction(BaseCase, SQLiteProductionConfig):
+    def create_app(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.db_path
+        return super(TestSQLiteProduction, self).create_app()
+
+    def tearDown(self):
+        super(TestSQLiteProduction, self).tearDown()
+        db.get_engine(self.app).dispose()
+        os.remove(self.db_path)
+
+    def test_pragmas(self):
+        pragma = lambda name: db.session.execute('PRAGMA ' + name).scalar()
+        self.assertEqual('wal', pragma('journal_mode'))
+        self.assertEqual(1, pragma('synchronous'))
+        self.assertEqual(-64000, pragma('cache_size'))
+        self.assertEqual(256 * 1024 * 1024, pragma('mmap_size'))
+
+    def test_pooled_connections(self):
+        engine = db.get_engine(self.app)
+        self.assertIsInstance(engine.pool, QueuePool)
+        self.assertEqual(8, engine.pool.size())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from app.exts import mail
+from tests import TestCase, AUTH
+
+USER_MAIL = 'foo@bar.de'
+USER_PASS = 'foobar'
+
+
+class TestMetrics(TestCase):
+    def metrics(self):
+        response = self.client.get('/metrics')
+        self.assert200(response)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        return dict(line.rsplit(' ', 1)
+                    for line in response.data.splitlines()
+                    if not line.startswith('#'))
+
+    def test_request_metrics(self):
+        self.assert200(self.client.get('/networks', auth = AUTH))
+        self.assert200(self.client.get('/networks', auth = AUTH))
+        self.assert404(self.client.get('/networks/10.0.0.0/24', auth = AUTH))
+
+        metrics = self.metrics()
+        self.assertEqual('2', metrics['http_requests_total{endpoint="api.networks",'
+                                      'method="GET",status="200"}'])
+        self.assertEqual('1', metrics['http_requests_total{endpoint="api.networks",'
+                                      'method="GET",status="404"}'])
+        self.assertEqual('3', metrics['http_request_duration_seconds_count'
+                                      '{endpoint="api.networks",method="GET"}'])
+        self.assertEqual('3', metrics['http_request_duration_seconds_bucket'
+            '{endpoint="api.networks",method="GET",le="+Inf"}'])
+        self.assertGreater(int(metrics['sql_queries_total'
+                                       '{endpoint="api.networks"}']), 0)
+        self.assertEqual('3', metrics['auth_duration_seconds_count'
+                                      '{method="basic"}'])
+
+    def test_mail_metrics(self):
+        with mail.record_messages() as outbox:
+            self.assert200(self.client.post('/user', data=dict(
+                email = USER_MAIL, password = USER_PASS)))
+        self.assertEqual(1, len(outbox))
+        self.assertEqual('1', self.metrics()['mail_send_duration_seconds_count'])
+
+
+class TestSlowRequests(TestCase):
+    SLOW_REQUEST_SECONDS = 0
+
+    def test_slow_request_log(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        self.app.logger.addHandler(handler)
+        try:
+            self.assert200(self.client.get('/networks', auth = AUTH))
+        finally:
+            self.app.logger.removeHandler(handler)
+
+        self.assertEqual(1, len(records))
+        message = records[0].getMessage()
+        self.assertIn('slow request GET /networks', message)
+        self.assertIn('SELECT', message)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from app.models import Network
+import json
+from app.models import Change, Network, User
+from app.exts import db
 from tests import TestCase, EmptyTestCase, EXISTING_USER_EMAIL, EXISTING_NETWORK_ADDRESS,\
     EXISTING_NETWORK_PREFIXLEN, AUTH
 
@@ -86,6 +88,63 @@ class TestNetworks(TestCase):
             ))
         self.assert400(response)
 
+    def test_create_adjacent_address(self):
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            address='192.168.0.64'
+            ))
+        self.assert200(response)
+        self.assertEqual(3, Network.query.count())
+
+    def test_update_conflicting_network(self):
+        url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN)
+        response = self.client.put(url, auth = AUTH, data=dict(prefixlen=24))
+        self.assert400(response)
+        msg = 'ip address conflict: 192.168.0.65/32'
+        self.assertEqual(response.json, dict(error=msg))
+
+    def test_update_keeps_address_range(self):
+        url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN)
+        self.assert200(self.client.put(url, auth = AUTH, data=dict(
+            address='10.0.0.0', prefixlen=28)))
+        network = Network.get('10.0.0.0', 28).one()
+        self.assertEqual(network.address_last, network.address_packed + 15)
+
+        self.assertEqual(1, Network.overlaps_with('10.0.0.8', 29).count())
+        self.assertEqual(0, Network.overlaps_with('10.0.0.16', 28).count())
+        self.assertEqual(0, Network.overlaps_with(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN).count())
+
+    def test_network_from_packed_columns(self):
+        network = Network.get(EXISTING_NETWORK_ADDRESS,
+                              EXISTING_NETWORK_PREFIXLEN).one()
+        self.assertEqual(u'192.168.0.0/26', network.cidr)
+        db.session.expunge_all()
+        loaded = Network.get(EXISTING_NETWORK_ADDRESS,
+                             EXISTING_NETWORK_PREFIXLEN).one()
+        self.assertIs(network.network, loaded.network)
+
+        network = loaded
+        network.prefixlen = 24
+        self.assertEqual(u'192.168.0.0/24', network.cidr)
+        self.assertEqual(network.address_packed + 255, network.address_last)
+        with self.assertRaises(AssertionError):
+            network.network_address = u'8.8.8.0'
+
+    def test_recreate_deleted_network(self):
+        url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN)
+        self.assert400(self.client.post('/networks', auth = AUTH, data=dict(
+            address=EXISTING_NETWORK_ADDRESS,
+            prefixlen=EXISTING_NETWORK_PREFIXLEN
+            )))
+        self.assert200(self.client.delete(url, auth = AUTH))
+        self.assert200(self.client.post('/networks', auth = AUTH, data=dict(
+            address=EXISTING_NETWORK_ADDRESS,
+            prefixlen=EXISTING_NETWORK_PREFIXLEN
+            )))
+
     def test_list_networks(self):
         response = self.client.get('/networks', auth = AUTH)
         self.assert200(response)
@@ -95,6 +154,81 @@ class TestNetworks(TestCase):
             owner=EXISTING_USER_EMAIL),
             response.json['networks'][0])
 
+    def test_list_networks_paginated(self):
+        response = self.client.get('/networks?limit=1', auth = AUTH)
+        self.assert200(response)
+        self.assertEqual(1, len(response.json['networks']))
+        self.assertDictContainsSubset(dict(network='192.168.0.0/26'),
+            response.json['networks'][0])
+
+        next_url = response.json['next'].replace('http://localhost', '')
+        response = self.client.get(next_url, auth = AUTH)
+        self.assert200(response)
+        self.assertDictContainsSubset(dict(address='192.168.0.65'),
+            response.json['networks'][0])
+
+        next_url = response.json['next'].replace('http://localhost', '')
+        response = self.client.get(next_url, auth = AUTH)
+        self.assertEqual(response.json, dict(networks=[], next=None))
+
+    def test_list_networks_invalid_cursor(self):
+        self.assert400(self.client.get('/networks?after=::1', auth = AUTH))
+        self.assert400(self.client.get('/networks?after=foo', auth = AUTH))
+
+    def test_list_networks_streamed(self):
+        response = self.client.get('/networks?stream=1', auth = AUTH)
+        self.assert200(response)
+        expected = self.client.get('/networks', auth = AUTH)
+        self.assertEqual(response.json, expected.json)
+
+        for value in ('0', 'false'):
+            response = self.client.get('/networks?limit=1&stream=' + value,
+                                       auth = AUTH)
+            self.assertEqual(1, len(response.json['networks']))
+
+    def test_list_networks_query_count(self):
+        for i in range(3):
+            user = User(u'user{}@test.de'.format(i), u'foobar')
+            db.session.add(Network(user, u'10.0.{}.0'.format(i), 24))
+        db.session.commit()
+        # fills the authentication cache
+        self.assert200(self.client.get('/user', auth = AUTH))
+
+        for url in ['/networks', '/networks?limit=10', '/networks?stream=1']:
+            db.session.remove()
+            with self.count_queries() as statements:
+                response = self.client.get(url, auth = AUTH)
+            self.assert200(response)
+            self.assertEqual(5, len(response.json['networks']))
+            # version of the change log and the listing itself
+            self.assertEqual(2, len(statements))
+
+    def test_list_networks_etag(self):
+        response = self.client.get('/networks', auth = AUTH)
+        self.assert200(response)
+        etag = response.headers['ETag']
+
+        with self.count_queries() as statements:
+            response = self.client.get('/networks', auth = AUTH,
+                headers = [('If-None-Match', etag)])
+        self.assertStatus(response, 304)
+        self.assertEqual(1, len(statements))
+
+        with self.count_queries() as statements:
+            response = self.client.get('/networks', auth = AUTH)
+        self.assert200(response)
+        self.assertEqual(etag, response.headers['ETag'])
+        self.assertEqual(2, len(response.json['networks']))
+        self.assertEqual(1, len(statements))
+
+        self.client.post('/networks', auth = AUTH, data=dict(
+            address=NETWORK_ADDRESS))
+        response = self.client.get('/networks', auth = AUTH,
+            headers = [('If-None-Match', etag)])
+        self.assert200(response)
+        self.assertNotEqual(etag, response.headers['ETag'])
+        self.assertEqual(3, len(response.json['networks']))
+
     def test_list_network(self):
         url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
             EXISTING_NETWORK_PREFIXLEN)
@@ -104,6 +238,121 @@ class TestNetworks(TestCase):
             prefixlen=EXISTING_NETWORK_PREFIXLEN, owner=EXISTING_USER_EMAIL),
             response.json['network'])
 
+    def test_pools(self):
+        response = self.client.get('/pools', auth = AUTH)
+        self.assert200(response)
+        pools = dict((p['network'], p) for p in response.json['pools'])
+        pool = pools['192.168.0.0/16']
+        self.assertEqual(65, pool['used'])
+        self.assertEqual(2 ** 16 - 65, pool['free'])
+        self.assertEqual(17, pool['largest_free_prefixlen'])
+        self.assertEqual(0, pools['10.0.0.0/8']['used'])
+
+        self.assert200(self.client.delete('/networks/{}/{}'.format(
+            EXISTING_NETWORK_ADDRESS, EXISTING_NETWORK_PREFIXLEN), auth = AUTH))
+        pools = self.client.get('/pools', auth = AUTH).json['pools']
+        self.assertIn(1, [p['used'] for p in pools])
+
+    def test_lookup_address(self):
+        response = self.client.get('/networks/192.168.0.10', auth = AUTH)
+        self.assert200(response)
+        self.assertDictContainsSubset(dict(network='192.168.0.0/26'),
+            response.json['network'])
+
+        response = self.client.get('/networks/192.168.0.65', auth = AUTH)
+        self.assert200(response)
+        self.assertDictContainsSubset(dict(address='192.168.0.65'),
+            response.json['network'])
+
+        self.assert404(self.client.get('/networks/192.168.0.64', auth = AUTH))
+        self.assert400(self.client.get('/networks/foo', auth = AUTH))
+
+    def test_lookup_many_addresses(self):
+        addresses = ['192.168.0.65', '10.0.0.1', '192.168.0.3', 'foo']
+        response = self.client.post('/networks/lookup', auth = AUTH,
+            data=dict(address=addresses))
+        self.assert200(response)
+        self.assertEqual(response.json['networks'], [
+            dict(address='192.168.0.65', network='192.168.0.65/32',
+                 owner=EXISTING_USER_EMAIL),
+            dict(address='10.0.0.1', network=None, owner=None),
+            dict(address='192.168.0.3', network='192.168.0.0/26',
+                 owner=EXISTING_USER_EMAIL),
+            dict(address='foo', network=None, owner=None),
+        ])
+
+        response = self.client.post('/networks/lookup', auth = AUTH,
+            data=json.dumps(dict(addresses=addresses[:1])),
+            content_type='application/json')
+        self.assert200(response)
+        self.assertEqual(1, len(response.json['networks']))
+
+    def lookup_one(self, address):
+        return self.client.post('/networks/lookup', auth = AUTH,
+            data=dict(address=[address])).json['networks'][0]['network']
+
+    def insert_elsewhere(self, first, prefixlen, seq = None):
+        """Inserts a network like another process would, only the change
+        log tells this one."""
+        user = User.query.filter_by(email = EXISTING_USER_EMAIL).one()
+        db.session.execute(Network.__table__.insert(), dict(
+            address_packed = first, num_addresses = 1 << (32 - prefixlen),
+            address_last = first + (1 << (32 - prefixlen)) - 1,
+            owner_id = user.id))
+        network = Network.query.filter_by(address_packed = first).one()
+        Change.log_rows('network', 'insert', [dict(id = network.id,
+            network = network.cidr, owner_id = user.id)])
+        if seq is not None:
+            Change.query.filter_by(object_id = network.id)\
+                        .update(dict(seq = seq))
+        db.session.commit()
+
+    def test_lookup_many_other_process(self):
+        self.assertIsNone(self.lookup_one('10.0.0.1'))
+        self.insert_elsewhere(0x0a000000, 24)
+        self.assertEqual('10.0.0.0/24', self.lookup_one('10.0.0.1'))
+
+    def test_change_committed_late(self):
+        self.assertIsNone(self.lookup_one('10.0.0.1'))
+        seq = Change.last_seq()
+        # seq + 1 commits after seq + 2
+        self.insert_elsewhere(0x0a010000, 24, seq + 2)
+        self.assertEqual('10.1.0.0/24', self.lookup_one('10.1.0.1'))
+        self.insert_elsewhere(0x0a000000, 24, seq + 1)
+        self.assertEqual('10.0.0.0/24', self.lookup_one('10.0.0.1'))
+
+    def test_lookup_moved_elsewhere(self):
+        self.assertEqual('192.168.0.0/26', Network.lookup(u'192.168.0.10').cidr)
+        # moved by another process, the change log doesn't tell yet
+        Network.query.filter_by(address_packed = 0xc0a80000).update(dict(
+            address_packed = 0x0a000000, address_last = 0x0a00003f))
+        db.session.commit()
+        self.assertIsNone(Network.lookup(u'192.168.0.10'))
+        self.assertEqual('10.0.0.0/26', Network.lookup(u'10.0.0.1').cidr)
+
+    def test_list_network_hosts(self):
+        url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN)
+        response = self.client.get(url, auth = AUTH)
+        self.assertDictContainsSubset(dict(first_host='192.168.0.1',
+            last_host='192.168.0.62', num_hosts=62), response.json['network'])
+
+        response = self.client.get(url + '/hosts?offset=60&limit=10',
+            auth = AUTH)
+        self.assert200(response)
+        self.assertEqual(response.json, dict(next=None,
+            hosts=['192.168.0.61', '192.168.0.62']))
+
+        response = self.client.get(url + '/hosts?limit=2', auth = AUTH)
+        self.assertEqual(response.json['hosts'], ['192.168.0.1', '192.168.0.2'])
+        self.assertIn('offset=2', response.json['next'])
+
+        response = self.client.get(url + '/hosts?stream=1', auth = AUTH)
+        self.assertEqual(62, len(response.json['hosts']))
+        response = self.client.get(url + '/hosts?stream=0&limit=2',
+                                   auth = AUTH)
+        self.assertEqual(2, len(response.json['hosts']))
+
     def test_delete_network(self):
         self.assertEqual(2, Network.query.count())
         url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
@@ -113,6 +362,46 @@ class TestNetworks(TestCase):
         self.assertEqual(response.json, dict(message='success'))
         self.assertEqual(1, Network.query.count())
 
+    def _post_bulk(self, networks, partial = False):
+        return self.client.post('/networks/bulk', auth = AUTH,
+            data=json.dumps(dict(networks=networks, partial=partial)),
+            content_type='application/json')
+
+    def test_bulk_create(self):
+        response = self._post_bulk([dict(prefixlen=30),
+            dict(address='10.0.0.0', prefixlen=30), dict(prefixlen=30)])
+        self.assert200(response)
+        self.assertEqual(['10.0.0.4/30', '10.0.0.0/30', '10.0.0.8/30'],
+            map(lambda n: n['network'], response.json['networks']))
+        self.assertEqual(5, Network.query.count())
+
+    def test_bulk_create_query_count(self):
+        with self.count_queries() as statements:
+            response = self._post_bulk([dict(prefixlen=30)] * 20)
+        self.assert200(response)
+        self.assertEqual(20, len(response.json['networks']))
+        # the networks aren't loaded again after the commit
+        self.assertEqual([], [s for s in statements
+                                if 'WHERE network.id = ?' in s])
+
+    def test_bulk_create_conflicts(self):
+        networks = [dict(address='10.0.0.0', prefixlen=24),
+            dict(address='10.0.0.128', prefixlen=25),
+            dict(address=EXISTING_NETWORK_ADDRESS), dict(address='foo')]
+        response = self._post_bulk(networks)
+        self.assert400(response)
+        self.assertEqual([1, 2, 3],
+            map(lambda e: e['index'], response.json['errors']))
+        self.assertEqual(response.json['errors'][0]['error'],
+            'ip address conflict: 10.0.0.0/24')
+        self.assertEqual(2, Network.query.count())
+
+        response = self._post_bulk(networks, partial = True)
+        self.assert200(response)
+        self.assertEqual(1, len(response.json['networks']))
+        self.assertEqual(3, len(response.json['errors']))
+        self.assertEqual(3, Network.query.count())
+
 class TestNetworksEmpty(EmptyTestCase):
     def test_create_new_address_with_defaults(self):
         response = self.client.post('/networks', auth = AUTH)
@@ -135,6 +424,17 @@ class TestNetworksEmpty(EmptyTestCase):
         network = Network.get(addr, prefixlen).one()
         self.assertEqual(network.prefixlen, 32)
 
+    def test_allocate_aligned_networks(self):
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            prefixlen=32))
+        self.assertEqual(response.json['network']['address'], '10.0.0.0')
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            prefixlen=30))
+        self.assertEqual(response.json['network']['network'], '10.0.0.4/30')
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            prefixlen=31))
+        self.assertEqual(response.json['network']['network'], '10.0.0.2/31')
+
     def test_fill_whole_address_space(self):
         self.assert200(self.client.post('/networks', auth = AUTH, data=dict(
             prefixlen=8)))
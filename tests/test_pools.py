@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from app.exts import db, pools
+from app.models import Network, Pool, PoolLock, User
+from app.pools import AddressPool, PoolSet
+from tests import TestCase, AUTH, EXISTING_USER_EMAIL
+
+OTHER_AUTH = (u'foo@bar.de', u'foobar')
+
+
+class TestPools(TestCase):
+    POOLS = [
+        { 'network' : '10.0.0.0/8', 'min_prefixlen' : 24,
+          'max_prefixlen' : 28 },
+        { 'network' : '192.168.0.0/16', 'owners' : [EXISTING_USER_EMAIL],
+          'quota' : 128 },
+    ]
+
+    def setUp(self):
+        super(TestPools, self).setUp()
+        user = User(*OTHER_AUTH)
+        user.verified = True
+        db.session.add(user)
+        db.session.commit()
+
+    def post(self, auth = AUTH, **data):
+        return self.client.post('/networks', auth = auth, data = data)
+
+    def test_find(self):
+        pool_set = pools.current
+        first = 0x0a000000
+        self.assertEqual('10.0.0.0/8',
+                         str(pool_set.find(first, first + 255).network))
+        self.assertIsNone(pool_set.find(first - 1, first))
+        self.assertIsNone(pool_set.find(0xac100000, 0xac100000))
+
+    def test_invalid_pools(self):
+        self.assertRaises(ValueError, AddressPool, 'fd00::/64')
+        self.assertRaises(ValueError, PoolSet, [AddressPool('10.0.0.0/8'),
+                                                AddressPool('10.1.0.0/16')])
+        PoolSet([AddressPool('10.0.0.0/16'), AddressPool('10.1.0.0/16')])
+
+    def test_prefixlens(self):
+        self.assert400(self.post(address = '10.0.0.0', prefixlen = 29))
+        self.assert400(self.post(address = '10.0.0.0', prefixlen = 20))
+        self.assert200(self.post(address = '10.0.0.0', prefixlen = 28))
+        self.assert400(self.post(address = '172.16.0.0', prefixlen = 24))
+
+        response = self.post(prefixlen = 24)
+        self.assert200(response)
+        self.assertEqual('10.0.1.0/24', response.json['network']['network'])
+
+    def test_owners(self):
+        response = self.post(OTHER_AUTH, address = '192.168.1.0',
+                             prefixlen = 30)
+        self.assert400(response)
+        self.assertIn('reserved', response.json['error'])
+
+        # the only pool allowing /30 is reserved
+        self.assert400(self.post(OTHER_AUTH, prefixlen = 30))
+        response = self.post(prefixlen = 30)
+        self.assert200(response)
+        self.assertEqual('192.168.0.68/30', response.json['network']['network'])
+
+    def test_pick_locks_candidate_pools(self):
+        # only the reserved pool allows /30
+        self.assert200(self.post(prefixlen = 30))
+        self.assertEqual([u'192.168.0.0/16'],
+                         [lock.pool for lock in PoolLock.query])
+
+    def test_quota(self):
+        # 65 addresses are taken already
+        self.assert400(self.post(address = '192.168.1.0', prefixlen = 26))
+        self.assert200(self.post(address = '192.168.1.0', prefixlen = 28))
+
+        networks = [dict(address = '192.168.2.0', prefixlen = 27),
+                    dict(address = '192.168.3.0', prefixlen = 27)]
+        response = self.client.post('/networks/bulk', auth = AUTH,
+            data = json.dumps(dict(networks = networks)),
+            content_type = 'application/json')
+        self.assert400(response)
+        self.assertEqual(1, response.json['errors'][0]['index'])
+
+    def insert_during_lock(self, first, prefixlen):
+        """Makes PoolLock.acquire insert a network first, like a
+        concurrent request committing between quota check and lock."""
+        original = PoolLock.__dict__['acquire']
+        def acquire(ranges = None):
+            PoolLock.acquire = original
+            user = User.query.filter_by(email = EXISTING_USER_EMAIL).one()
+            num_addresses = 1 << (32 - prefixlen)
+            db.session.execute(Network.__table__.insert(), dict(
+                address_packed = first, num_addresses = num_addresses,
+                address_last = first + num_addresses - 1,
+                owner_id = user.id))
+            return PoolLock.acquire(ranges)
+        PoolLock.acquire = staticmethod(acquire)
+        self.addCleanup(setattr, PoolLock, 'acquire', original)
+
+    def test_quota_checked_with_pool_locked(self):
+        # 65 addresses are taken, 32 more fit
+        self.insert_during_lock(0xc0a80200, 27)
+        response = self.post(address = '192.168.1.0', prefixlen = 27)
+        self.assert400(response)
+        self.assertIn('Quota', response.json['error'])
+
+        self.insert_during_lock(0xc0a80200, 27)
+        response = self.client.post('/networks/bulk', auth = AUTH,
+            data = json.dumps(dict(networks = [dict(address = '192.168.1.0',
+                                                    prefixlen = 27)])),
+            content_type = 'application/json')
+        self.assert400(response)
+        self.assertIn('Quota', response.json['errors'][0]['error'])
+
+    def test_pools_in_database(self):
+        db.session.add(Pool(u'172.16.0.0/12', max_prefixlen = 30))
+        db.session.commit()
+
+        self.assert200(self.post(address = '172.16.0.0', prefixlen = 24))
+        self.assert400(self.post(address = '10.1.0.0', prefixlen = 24))
+        pool = self.client.get('/pools', auth = AUTH).json['pools'][0]
+        self.assertEqual(dict(network='172.16.0.0/12', used=256,
+                              max_prefixlen=30), dict((k, pool[k])
+            for k in ('network', 'used', 'max_prefixlen')))
+        self.assertEqual(3, Network.query.count())
+
+
+class TestQuotaCandidates(TestCase):
+    POOLS = [
+        { 'network' : '10.0.0.0/24', 'quota' : 16 },
+        { 'network' : '10.0.1.0/24' },
+        { 'network' : '192.168.0.0/16' },
+    ]
+
+    def post(self, **data):
+        return self.client.post('/networks', auth = AUTH, data = data)
+
+    def test_next_pool_after_quota(self):
+        networks = []
+        for i in range(2):
+            response = self.post(prefixlen = 28)
+            self.assert200(response)
+            networks.append(response.json['network']['network'])
+        self.assertEqual(['10.0.0.0/28', '10.0.1.0/28'], networks)
+
+    def test_bulk_next_pool_after_quota(self):
+        response = self.client.post('/networks/bulk', auth = AUTH,
+            data = json.dumps(dict(networks = [dict(prefixlen = 28),
+                                               dict(prefixlen = 28)])),
+            content_type = 'application/json')
+        self.assert200(response)
+        self.assertEqual(['10.0.0.0/28', '10.0.1.0/28'],
+            [n['network'] for n in response.json['networks']])
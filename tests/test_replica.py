@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from app.database import REPLICA_BIND
+from app.models import Change, Network, User
+from app.exts import db
+from tests import TestCase, AUTH, EXISTING_NETWORK_ADDRESS,\
+    EXISTING_NETWORK_PREFIXLEN
+
+
+class TestReplica(TestCase):
+    """Primary and replica are two SQLite files, the replica is only
+    updated by replicate()."""
+
+    def create_app(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.primary_path = os.path.join(self.tmpdir, 'primary.db')
+        self.replica_path = os.path.join(self.tmpdir, 'replica.db')
+        self.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.primary_path
+        self.SQLALCHEMY_BINDS = { REPLICA_BIND :
+                                  'sqlite:///' + self.replica_path }
+        return super(TestReplica, self).create_app()
+
+    def setUp(self):
+        super(TestReplica, self).setUp()
+        db.Model.metadata.create_all(db.get_engine(self.app, REPLICA_BIND))
+
+    def tearDown(self):
+        super(TestReplica, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def replicate(self):
+        db.session.remove()
+        db.get_engine(self.app, REPLICA_BIND).dispose()
+        shutil.copy(self.primary_path, self.replica_path)
+
+    def test_get_reads_from_replica(self):
+        url = '/networks/{}/{}'.format(EXISTING_NETWORK_ADDRESS,
+            EXISTING_NETWORK_PREFIXLEN)
+        self.assert404(self.client.get(url, auth = AUTH))
+        self.assertEqual([], self.client.get('/networks', auth = AUTH)
+                                        .json['networks'])
+
+        self.replicate()
+        self.assert200(self.client.get(url, auth = AUTH))
+        self.assertEqual(2, len(self.client.get('/networks', auth = AUTH)
+                                           .json['networks']))
+
+    def test_writes_go_to_primary(self):
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            address='10.0.0.0', prefixlen=24))
+        self.assert200(response)
+        self.assertEqual(3, Network.query.count())
+        self.assert404(self.client.get('/networks/10.0.0.0/24', auth = AUTH))
+
+    def test_lookup_confirms_on_primary(self):
+        response = self.client.post('/networks', auth = AUTH, data=dict(
+            address='10.0.0.0', prefixlen=24))
+        self.assert200(response)
+        state = self.app.extensions['network_index']
+        allocator = state.allocator
+
+        response = self.client.get('/networks/10.0.0.1', auth = AUTH)
+        self.assert200(response)
+        self.assertEqual('10.0.0.0/24', response.json['network']['network'])
+        # the index was synced with the primary, not reloaded
+        self.assertTrue(state.loaded)
+        self.assertIs(allocator, state.allocator)
+        self.assertEqual(Change.last_seq(), state.seq)
+
+    def test_read_your_writes(self):
+        db.session.info['replica'] = True
+        self.assertEqual(0, User.query.count())
+
+        db.session.add(User(u'foo@bar.de', u'foobar123'))
+        db.session.flush()
+        self.assertEqual(2, User.query.count())
+        self.assertFalse(db.session.info['replica'])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+
+from app import create_lookup_app
+from app.exts import db
+from app.models import Network, User
+from app.snapshot import export_snapshot
+from tests import TestCase, EXISTING_USER_EMAIL, EXISTING_SINGLE_ADDRESS
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        super(TestSnapshot, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.SNAPSHOT_PATH = os.path.join(self.tmpdir, 'networks.snapshot')
+        self.lookup_client = create_lookup_app(self).test_client()
+
+    def tearDown(self):
+        super(TestSnapshot, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def lookup(self, address):
+        return self.lookup_client.get('/networks/{}'.format(address))
+
+    def test_lookup(self):
+        self.assertEqual(503, self.lookup('192.168.0.1').status_code)
+        self.assertEqual(2, export_snapshot(self.SNAPSHOT_PATH))
+
+        response = self.lookup('192.168.0.63')
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data), dict(network=dict(
+            network='192.168.0.0/26', address='192.168.0.0', prefixlen=26)))
+        response = self.lookup(EXISTING_SINGLE_ADDRESS)
+        self.assertEqual('192.168.0.65/32',
+                         json.loads(response.data)['network']['network'])
+
+        self.assert404(self.lookup('192.168.0.64'))
+        self.assert404(self.lookup('10.0.0.1'))
+        self.assert404(self.lookup('::1'))
+        self.assert400(self.lookup('foo'))
+
+    def test_lookup_owner(self):
+        self.LOOKUP_SHOW_OWNER = True
+        client = create_lookup_app(self).test_client()
+        export_snapshot(self.SNAPSHOT_PATH)
+        response = client.get('/networks/192.168.0.1')
+        self.assertEqual(EXISTING_USER_EMAIL,
+                         json.loads(response.data)['network']['owner'])
+
+    def test_reload_replaced_snapshot(self):
+        export_snapshot(self.SNAPSHOT_PATH)
+        self.assert404(self.lookup('10.0.0.1'))
+
+        user = User(u'foo@bar.de', u'foobar')
+        db.session.add(Network(user, u'10.0.0.0', 24))
+        db.session.commit()
+        export_snapshot(self.SNAPSHOT_PATH)
+
+        response = self.lookup('10.0.0.1')
+        self.assert200(response)
+        self.assertEqual(u'10.0.0.0/24',
+                         json.loads(response.data)['network']['network'])
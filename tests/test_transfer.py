@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from app.exts import db
+from app.models import Change, Network, User
+from app.transfer import RangeList
+from tests import TestCase, AUTH, EXISTING_USER_EMAIL
+
+ADMIN_AUTH = (u'admin@bar.de', u'admin123')
+
+
+class TestTransfer(TestCase):
+    ADMINS = [ADMIN_AUTH[0]]
+
+    def setUp(self):
+        super(TestTransfer, self).setUp()
+        user = User(*ADMIN_AUTH)
+        user.verified = True
+        db.session.add(user)
+        db.session.commit()
+
+    def export(self, fmt = 'jsonl'):
+        response = self.client.get('/admin/export?format={}'.format(fmt),
+                                   auth = ADMIN_AUTH)
+        self.assert200(response)
+        return response.data
+
+    def import_(self, data, fmt = 'jsonl'):
+        response = self.client.post('/admin/import?format={}'.format(fmt),
+                                    auth = ADMIN_AUTH, data = data,
+                                    content_type = 'application/x-ndjson')
+        self.assert200(response)
+        return response.json
+
+    def delete_all(self):
+        Network.query.delete()
+        User.query.filter(User.email != ADMIN_AUTH[0]).delete()
+        db.session.commit()
+
+    def assert_round_trip(self, fmt):
+        data = self.export(fmt)
+        self.delete_all()
+
+        stats = self.import_(data, fmt)
+        self.assertEqual((1, 2, 1, 0), (stats['users'], stats['networks'],
+            stats['skipped_users'], stats['failed']))
+        self.assertEqual(sorted(data.splitlines()),
+                         sorted(self.export(fmt).splitlines()))
+        self.assert200(self.client.get('/user', auth = AUTH))
+        self.assertEqual(EXISTING_USER_EMAIL,
+                         Network.lookup(u'192.168.0.65').owner.email)
+
+    def test_round_trip_jsonl(self):
+        records = [json.loads(l) for l in self.export().splitlines()]
+        self.assertEqual(['user', 'user', 'network', 'network'],
+                         [r['type'] for r in records])
+        self.assertEqual(dict(type='network', network='192.168.0.0/26',
+                              owner=EXISTING_USER_EMAIL), records[2])
+        self.assert_round_trip('jsonl')
+
+    def test_round_trip_csv(self):
+        lines = self.export('csv').splitlines()
+        self.assertEqual('type,email,password_hash,token,verified,network',
+                         lines[0])
+        self.assertEqual('network,test@test.de,,,,192.168.0.65/32', lines[-1])
+        self.assert_round_trip('csv')
+
+    def test_conflicts(self):
+        records = [
+            dict(type='user', email='foo@bar.de', password_hash='x'),
+            dict(type='network', network='192.168.0.64/30',
+                 owner='foo@bar.de'),
+            dict(type='network', network='10.0.0.0/24', owner='foo@bar.de'),
+            dict(type='network', network='10.0.0.128/25',
+                 owner='foo@bar.de'),
+            dict(type='network', network='1.2.3.0/24', owner='foo@bar.de'),
+            dict(type='network', network='10.1.0.0/24',
+                 owner='nobody@bar.de'),
+            dict(type='network', network='10.2.0.1/24', owner='foo@bar.de'),
+        ]
+        data = '\n'.join(json.dumps(r) for r in records) + '\nfoo\n'
+        stats = self.import_(data)
+        self.assertEqual((1, 1, 6), (stats['users'], stats['networks'],
+                                     stats['failed']))
+        self.assertEqual([2, 4, 5, 6, 7, 8],
+                         [e['record'] for e in stats['errors']])
+
+        # the index knows the imported network
+        response = self.client.post('/networks', auth = AUTH,
+            data = dict(address = '10.0.0.0', prefixlen = 28))
+        self.assert400(response)
+        logged = [(c.table, c.op) for c in Change.query]
+        self.assertIn(('user', 'insert'), logged)
+        self.assertIn(('network', 'insert'), logged)
+
+    def test_requires_admin(self):
+        self.assert403(self.client.get('/admin/export', auth = AUTH))
+        self.assert403(self.client.post('/admin/import', auth = AUTH))
+        self.assert400(self.client.get('/admin/export?format=xml',
+                                       auth = ADMIN_AUTH))
+
+    def test_range_list(self):
+        ranges = RangeList([(0, 9), (20, 29), (10, 15)])
+        self.assertEqual([0, 10, 20], list(ranges.firsts))
+        self.assertTrue(ranges.overlaps(15, 19))
+        self.assertTrue(ranges.overlaps(5, 100))
+        self.assertFalse(ranges.overlaps(16, 19))
+        self.assertFalse(ranges.overlaps(30, 30))
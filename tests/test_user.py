@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import urllib2
-from app.exts import mail
-from app.models import User
+from socket import error as socket_error
+from app.exts import mail, db, credentials
+from app.mailer import send_queued
+from app.models import User, Network, Change, OutgoingMail
 from tests import TestCase, EXISTING_USER_EMAIL, EXISTING_USER_PASS, AUTH
 
 USER_MAIL = 'foo@bar.de'
@@ -79,6 +81,80 @@ class TestUser(TestCase):
         self.assertDictContainsSubset(dict(email=EXISTING_USER_EMAIL),
             response.json['user'])
 
+    def test_list_user_query_count(self):
+        # the first login loads the index
+        self.assert200(self.client.get('/pools', auth = AUTH))
+        credentials.clear()
+        db.session.remove()
+        with self.count_queries() as statements:
+            response = self.client.get('/user', auth = AUTH)
+        self.assertEqual(2, len(response.json['user']['networks']))
+        # authentication, version of the change log and the networks
+        self.assertEqual(3, len(statements))
+
+    def test_cached_authentication(self):
+        self.assert200(self.client.get('/user', auth = AUTH))
+        db.session.remove()
+        with self.count_queries() as statements:
+            response = self.client.get('/user', auth = AUTH)
+        self.assert200(response)
+        # only the version of the change log, the response is cached too
+        self.assertEqual(1, len(statements))
+
+        response = self.client.put('/user', auth = AUTH, data=dict(
+            password = USER_PASS))
+        self.assert200(response)
+        self.assert401(self.client.get('/user', auth = AUTH))
+        self.assert200(self.client.get('/user',
+            auth = (EXISTING_USER_EMAIL, USER_PASS)))
+
+    def test_cached_authentication_after_change(self):
+        self.assert200(self.client.get('/user', auth = AUTH))
+        response = self.client.put('/user', auth = AUTH, data=dict(
+            password = USER_PASS))
+        self.assert200(response)
+        # the new login caches the changed user again
+        new_auth = (EXISTING_USER_EMAIL, USER_PASS)
+        self.assert200(self.client.get('/user', auth = new_auth))
+        self.assert401(self.client.get('/user', auth = AUTH))
+
+        response = self.client.put('/user', auth = new_auth, data=dict(
+            email = USER_MAIL))
+        self.assert200(response)
+        self.assert200(self.client.get('/user', auth = (USER_MAIL, USER_PASS)))
+        self.assert401(self.client.get('/user', auth = new_auth))
+
+    def test_cached_authentication_after_new_network(self):
+        self.assert200(self.client.get('/user', auth = AUTH))
+        user = User.query.filter_by(email = EXISTING_USER_EMAIL).one()
+        self.assert200(self.client.post('/networks', auth = AUTH,
+            data = dict(address = '10.0.0.0', prefixlen = 24)))
+        self.assertIsNotNone(credentials.state.users.get(user.id))
+
+        metrics = self.client.get('/metrics').data
+        self.assertIn('auth_cache_total{method="basic",result="hit"} 1',
+                      metrics)
+        self.assertIn('auth_cache_total{method="basic",result="miss"} 1',
+                      metrics)
+
+    def test_api_token(self):
+        response = self.client.post('/user/token', auth = AUTH)
+        self.assert200(response)
+        headers = [('Authorization', 'Bearer ' + response.json['token'])]
+
+        db.session.remove()
+        with self.count_queries() as statements:
+            response = self.client.get('/user', headers = headers)
+        self.assert200(response)
+        # version of the change log and the networks of the user
+        self.assertEqual(2, len(statements))
+
+        self.assert401(self.client.post('/user/token', headers = headers))
+        self.assert200(self.client.delete('/user/token', headers = headers))
+        self.assert401(self.client.get('/user', headers = headers))
+        self.assert401(self.client.get('/user', headers = [
+            ('Authorization', 'Bearer foo')]))
+
     def test_delete_user(self):
         self.assertEqual(1, User.query.count())
 
@@ -86,3 +162,77 @@ class TestUser(TestCase):
 
         self.assert200(response)
         self.assertEqual(0, User.query.count())
+
+    def test_delete_user_networks(self):
+        self.assert200(self.client.get('/networks', auth = AUTH))
+        with self.count_queries() as statements:
+            self.assert200(self.client.delete('/user', auth = AUTH))
+        self.assertFalse([s for s in statements
+                            if s.startswith('DELETE FROM network')])
+
+        self.assertEqual(0, Network.query.count())
+        deleted = Change.query.filter_by(table = 'network', op = 'delete')
+        self.assertEqual(2, deleted.count())
+        self.assertEqual(None, Network.lookup(u'192.168.0.1'))
+
+
+class TestUserMailQueue(TestCase):
+    MAIL_QUEUE = True
+
+    def test_create_user_queued(self):
+        with mail.record_messages() as outbox:
+            response = self.client.post('/user', data=dict(
+                email = USER_MAIL,
+                password = USER_PASS
+                )
+            )
+            self.assert200(response)
+            self.assertEqual(len(outbox), 0)
+            self.assertEqual(1, OutgoingMail.query.count())
+
+            self.assertEqual(1, send_queued())
+            self.assertEqual(len(outbox), 1)
+            self.assertEqual(outbox[0].recipients, [USER_MAIL])
+            self.assertEqual(0, OutgoingMail.pending().count())
+
+    def test_send_queued_retry(self):
+        self.client.get('/users/{}/lost_password'.format(EXISTING_USER_EMAIL))
+
+        def connect():
+            raise socket_error('connection refused')
+        mail.connect, original = connect, mail.connect
+        try:
+            self.assertEqual(0, send_queued())
+        finally:
+            mail.connect = original
+
+        row = OutgoingMail.query.one()
+        self.assertEqual(1, row.attempts)
+        self.assertEqual('connection refused', row.last_error)
+        self.assertEqual(0, OutgoingMail.pending().count())
+
+
+class TestUserOtherProcess(TestCase):
+    AUTH_CACHE_SYNC_INTERVAL = 0
+
+    def change_elsewhere(self, **values):
+        """Changes the user like another process would, only the change
+        log tells this one."""
+        user = User.query.filter_by(email = EXISTING_USER_EMAIL).one()
+        db.session.execute(User.__table__.update()
+            .where(User.__table__.c.id == user.id).values(**values))
+        Change.log_rows('user', 'update', [dict(id = user.id,
+            email = user.email, verified = user.verified)])
+        db.session.commit()
+
+    def test_cached_authentication(self):
+        self.assert200(self.client.get('/user', auth = AUTH))
+        self.change_elsewhere(verified = False)
+        self.assert401(self.client.get('/user', auth = AUTH))
+
+    def test_revoked_token(self):
+        response = self.client.post('/user/token', auth = AUTH)
+        headers = [('Authorization', 'Bearer ' + response.json['token'])]
+        self.assert200(self.client.get('/user', headers = headers))
+        self.change_elsewhere(token = u'revoked')
+        self.assert401(self.client.get('/user', headers = headers))